@@ -0,0 +1,153 @@
+"""
+Fast approximate mixture estimation with projected subgradient descent.
+
+Instead of the LP, minimize the hinge loss
+    sum over (merge i, competitor c) of max(0, w @ (counts_i[c] - counts_i[merge_i]) / denoms)
+over the probability simplex, for a random sample of merges and the competitors that beat them.
+The competitors are found with the same separation scan lazy_optimize uses, restricted to the
+sampled merges, and the scan is repeated with the improved mixture for a few rounds to pick up
+the competitors that only show up closer to the solution.
+
+The result is a near-feasible mixture for quick screening, and a warm start for lazy_optimize:
+the sampled constraints that are tight or violated at the approximate mixture are handed over
+as seed constraint blocks.
+"""
+
+import time
+from functools import partial
+
+import numpy as np
+import tqdm.auto as tqdm
+
+from precompute import precompute
+from separation import Scanner
+
+
+def project_simplex(v):
+    """
+    Euclidean projection of v onto the probability simplex.
+    """
+    u = np.sort(v)[::-1]
+    css = np.cumsum(u) - 1
+    k = np.flatnonzero(u - css / np.arange(1, len(v) + 1) > 0)[-1]
+    return np.maximum(v - css[k] / (k + 1), 0)
+
+
+def subgradient_descent(D, w, iters=500, step=0.1):
+    """
+    Minimize the hinge loss sum(max(0, D @ w)) over the simplex starting from w, with normalized
+    subgradient steps of size step / sqrt(t). Returns the best iterate and its loss.
+    """
+    best_w, best_loss = w, np.inf
+    for t in range(1, iters + 2):
+        Dw = D @ w
+        violated = Dw > 0
+        loss = Dw[violated].sum()
+        if loss < best_loss:
+            best_w, best_loss = w, loss
+        g = violated.astype(D.dtype) @ D
+        norm = np.linalg.norm(g)
+        if norm == 0 or t > iters:
+            break
+        w = project_simplex(w - step / np.sqrt(t) * g / norm)
+    return best_w, best_loss
+
+
+def approximate_mixture(
+    pre,
+    mids,
+    denoms,
+    rounds=5,
+    sample_merges=2000,
+    competitor_batch_size=10,
+    iters=500,
+    seed=0,
+    progress=lambda x, **_: x,
+):
+    """
+    Returns (lang_vals, blocks, stats), where blocks are the sampled (merge index, merge pair,
+    competitors) constraint blocks that are tight or violated at lang_vals.
+    """
+    rng = np.random.default_rng(seed)
+    num_langs = len(denoms)
+    valid = [i for i, mid in enumerate(mids) if mid is not None]
+    if not valid:
+        # no merge can be constrained, so nothing moves the mixture away from uniform
+        stats = dict(
+            rounds=0, sampled_merges=0, constraints=0, tight_constraints=0, hinge_loss=0.0, time=0.0
+        )
+        return np.ones(num_langs) / num_langs, [], stats
+    sampled = set(rng.choice(valid, min(sample_merges, len(valid)), replace=False).tolist())
+    scanner = Scanner(pre, [mid if i in sampled else None for i, mid in enumerate(mids)])
+
+    w = np.ones(num_langs) / num_langs
+    blocks, rows, seen = [], [], set()
+    loss, scale, num_rounds, start = 0.0, 1.0, 0, time.perf_counter()
+    for _ in progress(range(rounds), desc="approximate rounds"):
+        num_rounds += 1
+        scan = scanner.scan(
+            w / denoms,
+            np.zeros(len(pre.id_to_pair)),
+            np.zeros(len(mids)),
+            seen,
+            competitor_batch_size,
+            np.inf,
+            0.0,
+        )
+        if not scan.found:
+            break
+        for i, mid, competitors, _ in scan.found:
+            counts = pre.count_index.counts_at(i, [mid] + competitors) / denoms
+            blocks.append((i, mid, competitors))
+            rows.append(counts[1:] - counts[:1])
+            seen.update((i, c) for c in competitors)
+
+        D = np.vstack(rows)
+        # the counts are normalized by the denominators, rescale so the steps are well sized
+        scale = np.abs(D).max()
+        w, loss = subgradient_descent(D / scale, w, iters=iters)
+        loss *= scale
+
+    # keep the competitors that still (nearly) beat their merge
+    tight, offset = [], 0
+    margin = np.vstack(rows) @ w / scale if rows else np.zeros(0)
+    for i, mid, competitors in blocks:
+        block_margin = margin[offset : offset + len(competitors)]
+        offset += len(competitors)
+        kept = [c for c, m in zip(competitors, block_margin) if m > -1e-3]
+        if kept:
+            tight.append((i, mid, kept))
+
+    stats = dict(
+        rounds=num_rounds,
+        sampled_merges=len(sampled),
+        constraints=len(seen),
+        tight_constraints=sum(len(cands) for _, _, cands in tight),
+        hinge_loss=float(loss),
+        time=time.perf_counter() - start,
+    )
+    return w, tight, stats
+
+
+def approx_optimize(merges, pair_counts, lang_denoms, num_merges=3000, verbose=True, pre=None, **kwargs):
+    """
+    Estimate the mixture with approximate_mixture only, as a quick screening alternative to
+    lazy_optimize. Returns a solution dict in the same format, without the LP fields.
+    """
+    langs = list(pair_counts.keys())
+    P = partial(tqdm.tqdm, dynamic_ncols=True) if verbose else lambda x, **_: x
+    if pre is None:
+        pre = precompute(pair_counts, num_merges, verbose=verbose)
+
+    merge_subset = [str(merge) for merge in merges[:num_merges]]
+    mids = pre.merge_ids(merge_subset)
+    denoms = np.array([lang_denoms[lang] for lang in langs])
+    lang_vals, _, stats = approximate_mixture(pre, mids, denoms, progress=P, **kwargs)
+    print(f"hinge loss: {stats['hinge_loss']} after {stats['rounds']} rounds")
+
+    return dict(
+        lang_vals=dict(zip(langs, lang_vals.tolist())),
+        missing_merges={merge for merge, mid in zip(merge_subset, mids) if mid is None},
+        approx=stats,
+        timing=dict(precompute=pre.timing, approx_time=stats["time"]),
+    )
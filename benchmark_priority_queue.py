@@ -0,0 +1,147 @@
+"""
+Benchmark the priority queue used by the separation pass of lazy_optimize.
+
+Runs one full separation sweep over the first --merges merges with a fixed mixture (uniform, or
+the lang_vals of an existing solution file) and times the indexed tournament tree against the
+prqrs heap with lazy deletion that lazy_optimize used before. Both sweeps must find the same
+violating competitors at every merge. The per-step priority changes are mixed up front, as
+separation.scan_merges does in blocks, so only the priority queue work is timed.
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import simdjson as json
+
+from precompute import precompute
+from tournament_tree import TournamentTree
+from utils import load_data
+
+PRIMAL_TOL = 1e-6
+
+
+def mixed_steps(pre, mids, mix):
+    """
+    The pairs changed at every step and mix @ their count deltas.
+    """
+    dca = pre.delta_count_arrays
+    mixed, indptr = dca.mixed(mix, 0, len(mids) - 1), dca.indptr
+    return [
+        (dca.pair_ids[indptr[i] : indptr[i + 1]], mixed[indptr[i] : indptr[i + 1]])
+        for i in range(len(mids) - 1)
+    ]
+
+
+def sweep_tree(pre, mids, mix, batch_size):
+    prios = pre.initial_prios(mix)
+    steps = mixed_steps(pre, mids, mix)
+    found, pops = [], 0
+    start = time.perf_counter()
+    pq = TournamentTree.from_numpy(prios)
+    for i, mid in enumerate(mids):
+        competitors = []
+        if mid is not None:
+            cutoff = prios[mid] + PRIMAL_TOL
+            for tid, tprio in pq.descending(exclude=mid):
+                pops += 1
+                if tprio <= cutoff:
+                    break
+                competitors.append(tid)
+                if len(competitors) >= batch_size:
+                    break
+        found.append(sorted(competitors))
+        if i < len(mids) - 1:
+            items, mixdcounts = steps[i]
+            prios[items] += mixdcounts
+            pq.update(items, prios[items])
+    elapsed = time.perf_counter() - start
+    return found, dict(time=elapsed, pops=pops, stale_pops=0, final_size=len(pq))
+
+
+def sweep_prqrs(pre, mids, mix, batch_size):
+    from prqrs import PriorityQueue
+
+    prios = pre.initial_prios(mix)
+    steps = mixed_steps(pre, mids, mix)
+    found, pops, stale = [], 0, 0
+    start = time.perf_counter()
+    pq = PriorityQueue.from_numpy(prios)
+    for i, mid in enumerate(mids):
+        competitors = []
+        if mid is not None:
+            cutoff = prios[mid] + PRIMAL_TOL
+            popped = []
+            while len(competitors) < batch_size:
+                item = pq.pop()
+                pops += 1
+                # cursed float equality test
+                if prios[item.value] != item.priority:
+                    stale += 1
+                    continue
+                popped.append(item)
+                if item.value == mid:
+                    continue
+                if item.priority <= cutoff:
+                    break
+                competitors.append(item.value)
+            for item in popped:
+                pq.push(item)
+        found.append(sorted(competitors))
+        if i < len(mids) - 1:
+            items, mixdcounts = steps[i]
+            prios[items] += mixdcounts
+            pq.push_batch(items, prios[items])
+    elapsed = time.perf_counter() - start
+    return found, dict(time=elapsed, pops=pops, stale_pops=stale, final_size=len(pq))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="BenchmarkPriorityQueue")
+    parser.add_argument("data_root")
+    parser.add_argument(
+        "--merges", type=int, help="Number of merges to consider", default=30000
+    )
+    parser.add_argument(
+        "--denom", type=str, help="Which normalization to apply", default="pairs"
+    )
+    parser.add_argument(
+        "--solution", type=str, help="Take the mixture from this solution file", default=None
+    )
+    parser.add_argument(
+        "--batch_size", type=int, help="Competitors to look at per merge", default=10
+    )
+    args = parser.parse_args()
+    root = Path(args.data_root)
+
+    merges, pair_counts, training_counts = load_data(root, verbose=True)
+    pre = precompute(pair_counts, args.merges, verbose=True)
+    langs = list(pair_counts.keys())
+    denoms = np.array([training_counts[args.denom][lang] for lang in langs])
+    if args.solution is None:
+        lang_vals = np.ones(len(langs)) / len(langs)
+    else:
+        with open(args.solution) as f:
+            solution_vals = json.load(f)["lang_vals"]
+        lang_vals = np.array([solution_vals[lang] for lang in langs])
+    mix = lang_vals / denoms
+    mids = [pre.pair_to_id.get(str(merge)) for merge in merges[: args.merges]]
+
+    results = {}
+    found_tree, results["tournament tree"] = sweep_tree(pre, mids, mix, args.batch_size)
+    try:
+        found_prqrs, results["prqrs"] = sweep_prqrs(pre, mids, mix, args.batch_size)
+    except ImportError:
+        print("prqrs is not installed, skipping the heap baseline")
+    else:
+        # ties may be broken differently, so only compare the competitor sets
+        mismatches = sum(a != b for a, b in zip(found_tree, found_prqrs))
+        print(f"merges with differing competitors: {mismatches}")
+
+    print(f"{len(mids)} merges, {len(pre.id_to_pair)} pairs")
+    for name, stats in results.items():
+        print(
+            f"{name:>16}: {stats['time']:.3f}s, {stats['pops']} pops "
+            f"({stats['stale_pops']} stale), {stats['final_size']} entries at the end"
+        )
@@ -0,0 +1,63 @@
+"""
+Checkpoints of the lazy_optimize solver state.
+
+The LP itself is not serialized. Every constraint block lazy_optimize adds is determined by its
+merge index, the merge pair and the ordered list of competitor pairs, so the checkpoint records
+those and the model is rebuilt by replaying them in order. This creates the same rows in the
+same order as the original run, but with pruning not necessarily the same pair violation
+variables, so their values are stored by pair. Alongside them it stores the last primal
+solution, the active set and the epoch counter, so separation continues where the run stopped.
+
+Blocks refer to pairs by id, and ids depend on the precomputation (--prune_pairs renumbers
+them), so the checkpoint also records a digest of the id -> pair table and is only resumed
+with the same table.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+
+import simdjson as json
+
+CHECKPOINT_VERSION = 2
+
+
+def checkpoint_path(solution_path):
+    solution_path = Path(solution_path)
+    return solution_path.with_name("checkpoint" + solution_path.name[len("solution"):])
+
+
+def write_json_atomic(path, data):
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w") as f:
+        json.dump(data, f)
+    # never leave a half-written file behind if the job is killed mid-write
+    os.replace(tmp, path)
+
+
+def pairs_digest(id_to_pair):
+    h = hashlib.sha256()
+    for pair in id_to_pair:
+        h.update(pair.encode("utf-8") + b"\n")
+    return h.hexdigest()
+
+
+def save_checkpoint(path, state):
+    write_json_atomic(path, dict(state, version=CHECKPOINT_VERSION))
+
+
+def load_checkpoint(path, langs, num_merges, denoms, pairs):
+    """
+    Load the checkpoint at path, checking that it was written for the same problem. pairs is
+    the pairs_digest of the precomputation's id_to_pair.
+    """
+    with open(path) as f:
+        state = json.load(f)
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"{path}: unsupported checkpoint version {state.get('version')}")
+    expected = dict(langs=list(langs), num_merges=num_merges, denoms=list(denoms), pairs=pairs)
+    for key, value in expected.items():
+        if state[key] != value:
+            raise ValueError(f"{path}: checkpoint has different {key}, refusing to resume")
+    return state
@@ -0,0 +1,73 @@
+"""
+Column generation over categories for lazy_optimize.
+
+With many candidate categories the final mixture is sparse, so most columns of the LP are zero
+at the optimum. Column generation solves over an active subset of the categories and prices the
+others with the duals of the restricted LP: for a category j with normalized counts a_j, the
+reduced cost of its weight variable is
+
+    -mu - sum over rows (i, merge, competitor) of y * (a_j[merge at i] - a_j[competitor at i])
+
+where mu is the dual of the sum-to-one row and y the duals of the merge constraints. Separation
+is exact over the active categories (inactive ones have zero weight), and rows that were never
+generated have zero dual, so once no category has a negative reduced cost the restricted
+solution is optimal for the full problem.
+
+Inactive categories are read from disk (memory-mapped stores or streamed json) one at a time
+while pricing and dropped right after. Merges whose pair doesn't occur in any active category
+are unconstrained in the restricted LP, so categories that contain them are priced in as well.
+"""
+
+import numpy as np
+
+from precompute import precompute
+
+# reduced costs above this are treated as non-negative
+REDUCED_COST_TOL = 1e-9
+
+
+def category_counts(apc, num_merges):
+    """
+    The precomputed counts of a single category, read lazily from disk.
+    """
+    return precompute(dict(category=apc), num_merges, verbose=False)
+
+
+def counts_at(pre, step, pairs):
+    """
+    The counts of the given pair strings at a step, zero for pairs the category never has.
+    """
+    pids = [pre.pair_to_id.get(pair) for pair in pairs]
+    known = [k for k, pid in enumerate(pids) if pid is not None]
+    counts = np.zeros(len(pairs))
+    if known:
+        counts[known] = pre.count_index.counts_at(step, [pids[k] for k in known])[:, 0]
+    return counts
+
+
+def initial_columns(pair_counts, merges, lang_denoms, k, num_steps=100):
+    """
+    The k categories in which the first num_steps merges are most frequent, relative to their
+    denominators.
+    """
+    scores = {}
+    for lang, apc in pair_counts.items():
+        pre = category_counts(apc, num_steps)
+        score = sum(counts_at(pre, i, [str(merge)])[0] for i, merge in enumerate(merges[:num_steps]))
+        scores[lang] = score / lang_denoms[lang]
+    return sorted(scores, key=lambda lang: -scores[lang])[:k]
+
+
+def price_category(apc, denom, rows, simplex_dual, missing, num_merges):
+    """
+    Reduced cost of a category's weight, and the number of missing merges it contains.
+    rows are (merge index, merge pair, competitor pairs, duals) with pairs as strings, missing
+    the (merge index, merge pair) of merges without a pair id in the active categories.
+    """
+    pre = category_counts(apc, num_merges)
+    reduced_cost = -simplex_dual
+    for i, merge, competitors, duals in rows:
+        counts = counts_at(pre, i, [merge] + competitors) / denom
+        reduced_cost -= np.dot(duals, counts[0] - counts[1:])
+    covered = sum(counts_at(pre, i, [merge])[0] > 0 for i, merge in missing)
+    return reduced_cost, int(covered)
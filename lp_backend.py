@@ -0,0 +1,272 @@
+"""
+LP backends for lazy_optimize.
+
+The solver only needs a small slice of an LP API: add bounded variables, add dense row batches
+(like gurobipy's addMConstr), minimize a sum of variables, re-optimize and read primal values,
+and read row slacks and duals and remove rows to prune the model. Variables are referred to by
+integer column indices and rows by ids that stay valid when other rows are removed. Both
+backends keep the model between optimize() calls, so re-solves after new rows are added
+warm-start from the previous basis.
+"""
+
+import numpy as np
+
+BACKENDS = ("gurobi", "highs")
+
+
+class LPBackend:
+    name = None
+
+    def add_vars(self, n, lb=0.0, ub=np.inf, names=None):
+        """
+        Add n variables and return their column indices.
+        """
+        raise NotImplementedError
+
+    def add_var(self, lb=0.0, ub=np.inf, name=None):
+        return self.add_vars(1, lb, ub, None if name is None else [name])[0]
+
+    def add_rows(self, A, cols, sense, b):
+        """
+        Add the rows A @ x[cols] (sense) b, where sense is one of ">=", "<=", "=", and return
+        their row ids.
+        """
+        raise NotImplementedError
+
+    def remove_rows(self, rows):
+        raise NotImplementedError
+
+    def slacks(self, rows):
+        """
+        Distance of every given row from its bound at the last solution (0 for binding rows).
+        """
+        raise NotImplementedError
+
+    def duals(self, rows):
+        raise NotImplementedError
+
+    def set_objective(self, cols):
+        """
+        Minimize the sum of the given columns.
+        """
+        raise NotImplementedError
+
+    def optimize(self, time_limit=None):
+        """
+        Solve, giving up after time_limit seconds. Returns False if the time limit was hit, in
+        which case there is no solution to read.
+        """
+        raise NotImplementedError
+
+    def values(self, cols):
+        """
+        Primal values of the given columns from the last solve.
+        """
+        raise NotImplementedError
+
+    @property
+    def objective_value(self):
+        raise NotImplementedError
+
+    @property
+    def primal_tol(self):
+        raise NotImplementedError
+
+    @property
+    def num_vars(self):
+        raise NotImplementedError
+
+    @property
+    def num_rows(self):
+        raise NotImplementedError
+
+
+class GurobiBackend(LPBackend):
+    name = "gurobi"
+
+    def __init__(self, verbose=False, threads=0):
+        import gurobipy as gp
+
+        self.gp = gp
+        with gp.Env(empty=True) as env:
+            env.setParam("OutputFlag", 1 if verbose else 0)
+            if threads:
+                env.setParam("Threads", threads)
+            env.start()
+            self.m = gp.Model("tokenizer_attack", env=env)
+        self.vars = []
+        self.rows = {}
+        self._next_row = 0
+
+    def add_vars(self, n, lb=0.0, ub=np.inf, names=None):
+        start = len(self.vars)
+        for k in range(n):
+            name = "" if names is None else names[k]
+            self.vars.append(self.m.addVar(lb=lb, ub=ub, name=name))
+        return list(range(start, start + n))
+
+    def add_rows(self, A, cols, sense, b):
+        constrs = self.m.addMConstr(A, [self.vars[c] for c in cols], sense, b).tolist()
+        ids = list(range(self._next_row, self._next_row + len(constrs)))
+        self._next_row += len(constrs)
+        self.rows.update(zip(ids, constrs))
+        return ids
+
+    def remove_rows(self, rows):
+        self.m.remove([self.rows.pop(r) for r in rows])
+
+    def slacks(self, rows):
+        return np.abs(self.m.getAttr("Slack", [self.rows[r] for r in rows]))
+
+    def duals(self, rows):
+        return np.array(self.m.getAttr("Pi", [self.rows[r] for r in rows]))
+
+    def set_objective(self, cols):
+        self.m.setObjective(
+            self.gp.quicksum(self.vars[c] for c in cols), self.gp.GRB.MINIMIZE
+        )
+
+    def optimize(self, time_limit=None):
+        self.m.Params.TimeLimit = self.gp.GRB.INFINITY if time_limit is None else time_limit
+        self.m.optimize()
+        if self.m.Status == self.gp.GRB.TIME_LIMIT:
+            return False
+        if self.m.Status != self.gp.GRB.OPTIMAL:
+            raise RuntimeError(f"Gurobi: status {self.m.Status}")
+        return True
+
+    def values(self, cols):
+        return np.array(self.m.getAttr("X", [self.vars[c] for c in cols]))
+
+    @property
+    def objective_value(self):
+        return self.m.ObjVal
+
+    @property
+    def primal_tol(self):
+        return self.m.getParamInfo("FeasibilityTol")[2]
+
+    @property
+    def num_vars(self):
+        return len(self.vars)
+
+    @property
+    def num_rows(self):
+        self.m.update()
+        return self.m.NumConstrs
+
+
+class HighsBackend(LPBackend):
+    name = "highs"
+
+    def __init__(self, verbose=False, threads=0):
+        import highspy
+
+        self.highspy = highspy
+        self.h = highspy.Highs()
+        self.h.setOptionValue("output_flag", verbose)
+        if threads:
+            self.h.setOptionValue("threads", threads)
+        self.inf = highspy.kHighsInf
+        self._num_vars = 0
+        self._objective = np.zeros(0)
+        # row id and bounds of every row of the HiGHS model, in model order
+        self._row_ids = np.zeros(0, np.int64)
+        self._row_lower = np.zeros(0)
+        self._row_upper = np.zeros(0)
+        self._next_row = 0
+
+    def _bound(self, value):
+        return min(max(value, -self.inf), self.inf)
+
+    def add_vars(self, n, lb=0.0, ub=np.inf, names=None):
+        start = self._num_vars
+        self.h.addVars(
+            n, np.full(n, self._bound(lb)), np.full(n, self._bound(ub))
+        )
+        self._num_vars += n
+        self._objective = np.r_[self._objective, np.zeros(n)]
+        return list(range(start, start + n))
+
+    def add_rows(self, A, cols, sense, b):
+        A = np.asarray(A, np.float64)
+        b = np.asarray(b, np.float64)
+        cols = np.asarray(cols, np.int32)
+        lower = b if sense in (">=", "=") else np.full(len(b), -self.inf)
+        upper = b if sense in ("<=", "=") else np.full(len(b), self.inf)
+        rows, nz = np.nonzero(A)
+        starts = np.searchsorted(rows, np.arange(len(A))).astype(np.int32)
+        self.h.addRows(
+            len(A), lower, upper, len(rows), starts, cols[nz], A[rows, nz]
+        )
+        ids = np.arange(self._next_row, self._next_row + len(A))
+        self._next_row += len(A)
+        self._row_ids = np.r_[self._row_ids, ids]
+        self._row_lower = np.r_[self._row_lower, lower]
+        self._row_upper = np.r_[self._row_upper, upper]
+        return ids.tolist()
+
+    def _positions(self, rows):
+        # row ids only grow, so the ids in model order are sorted
+        return np.searchsorted(self._row_ids, rows).astype(np.int32)
+
+    def remove_rows(self, rows):
+        positions = np.sort(self._positions(rows))
+        self.h.deleteRows(len(positions), positions)
+        self._row_ids = np.delete(self._row_ids, positions)
+        self._row_lower = np.delete(self._row_lower, positions)
+        self._row_upper = np.delete(self._row_upper, positions)
+
+    def slacks(self, rows):
+        positions = self._positions(rows)
+        value = np.asarray(self.h.getSolution().row_value)[positions]
+        return np.minimum(value - self._row_lower[positions], self._row_upper[positions] - value)
+
+    def duals(self, rows):
+        return np.asarray(self.h.getSolution().row_dual)[self._positions(rows)]
+
+    def set_objective(self, cols):
+        objective = np.zeros(self._num_vars)
+        objective[cols] = 1
+        changed = np.flatnonzero(objective != self._objective).astype(np.int32)
+        if len(changed):
+            self.h.changeColsCost(len(changed), changed, objective[changed])
+        self._objective = objective
+
+    def optimize(self, time_limit=None):
+        self.h.setOptionValue("time_limit", self.inf if time_limit is None else float(time_limit))
+        # HiGHS keeps the basis of the previous solve and hot-starts from it
+        self.h.run()
+        status = self.h.getModelStatus()
+        if status == self.highspy.HighsModelStatus.kTimeLimit:
+            return False
+        if status != self.highspy.HighsModelStatus.kOptimal:
+            raise RuntimeError(f"HiGHS: {self.h.modelStatusToString(status)}")
+        return True
+
+    def values(self, cols):
+        return np.asarray(self.h.getSolution().col_value)[cols]
+
+    @property
+    def objective_value(self):
+        return self.h.getInfo().objective_function_value
+
+    @property
+    def primal_tol(self):
+        return self.h.getOptions().primal_feasibility_tolerance
+
+    @property
+    def num_vars(self):
+        return self._num_vars
+
+    @property
+    def num_rows(self):
+        return self.h.getNumRow()
+
+
+def make_backend(name, verbose=False, threads=0):
+    if name == "gurobi":
+        return GurobiBackend(verbose=verbose, threads=threads)
+    if name == "highs":
+        return HighsBackend(verbose=verbose, threads=threads)
+    raise ValueError(f"Unknown LP backend: {name} (expected one of {BACKENDS})")
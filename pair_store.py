@@ -0,0 +1,360 @@
+"""
+Columnar, memory-mappable storage for the per-merge pair counts written by dump_frequencies.py.
+
+A store is a directory that lives next to all_pair_counts.json and contains
+    meta.json         format version, array sizes, and the size and modification time of the
+                      all_pair_counts.json it was converted from
+    offsets.npy       int64[num_steps + 1], the records of step i are offsets[i]:offsets[i + 1]
+    pair_ids.npy      int32[num_records], interned pair of every record
+    deltas.npy        int64[num_records], change of the pair count since the pair's previous
+                      record (records of step 0 hold the absolute counts)
+    pair_cut.npy      int64[num_steps + 1], number of distinct pairs seen before step i
+    pair_offsets.npy  int64[num_pairs + 1], byte ranges of the pair strings in pair_bytes.bin
+    pair_bytes.bin    utf-8 encoded pair strings, concatenated
+
+Pair ids are assigned in order of first appearance, so the pairs used by the first T steps are
+exactly the first pair_cut[T] ids, and a solve over T merges only touches a prefix of every
+file. Records within a step keep the order of the original JSON dict, so a store round-trips to
+the same all_pair_counts.json.
+
+all_pair_counts.json itself can also be read one merge step at a time with PairCountFile, which
+never holds more than the step being parsed.
+"""
+
+import os
+import re
+import shutil
+from pathlib import Path
+
+import click
+import numpy as np
+import simdjson as json
+
+STORE_NAME = "all_pair_counts"
+STORE_VERSION = 1
+
+
+def store_path(category_dir):
+    return Path(category_dir) / STORE_NAME
+
+
+def has_pair_counts(category_dir):
+    category_dir = Path(category_dir)
+    return (store_path(category_dir) / "meta.json").exists() or (
+        category_dir / "all_pair_counts.json"
+    ).exists()
+
+
+def source_stat(path):
+    stat = Path(path).stat()
+    return dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+
+def is_stale(category_dir):
+    """
+    Whether all_pair_counts.json was changed (e.g. dumped again) after the store was written
+    from it. A store without its JSON next to it is never stale.
+    """
+    category_dir = Path(category_dir)
+    source = category_dir / "all_pair_counts.json"
+    meta_path = store_path(category_dir) / "meta.json"
+    if not source.exists():
+        return False
+    with meta_path.open() as f:
+        recorded = json.load(f).get("source")
+    if recorded is None:
+        # stores written before the source was recorded
+        return source.stat().st_mtime_ns > meta_path.stat().st_mtime_ns
+    return recorded != source_stat(source)
+
+
+def grouped_cumsum(keys, values):
+    """
+    Running sum of values within each key, in the original order of the records.
+    """
+    order = np.argsort(keys, kind="stable")
+    sorted_keys, sorted_values = keys[order], values[order]
+    sums = np.cumsum(sorted_values)
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    if len(starts):
+        base = sums[starts] - sorted_values[starts]
+        sums -= np.repeat(base, np.diff(np.r_[starts, len(keys)]))
+    out = np.empty_like(sums)
+    out[order] = sums
+    return out
+
+
+class PairCountStore:
+    """
+    Read-only view of a pair count store, restricted to its first num_steps merge steps.
+
+    Indexing with an integer returns the same {pair: count} dict as the corresponding entry of
+    all_pair_counts.json, and slicing from the start returns a shorter view, so a store can be
+    used anywhere the parsed JSON list is expected.
+    """
+
+    def __init__(self, path, num_steps=None):
+        self.path = Path(path)
+        with (self.path / "meta.json").open() as f:
+            meta = json.load(f)
+        if meta["version"] != STORE_VERSION:
+            raise ValueError(
+                f"{self.path}: unsupported store version {meta['version']} (expected {STORE_VERSION})"
+            )
+        self.total_steps = meta["num_steps"]
+        self.num_steps = (
+            self.total_steps if num_steps is None else min(num_steps, self.total_steps)
+        )
+
+        load = lambda name: np.load(self.path / name, mmap_mode="r")
+        self._offsets = load("offsets.npy")
+        self._pair_ids = load("pair_ids.npy")
+        self._deltas = load("deltas.npy")
+        self._pair_cut = load("pair_cut.npy")
+        self._pair_offsets = load("pair_offsets.npy")
+        self._pairs = None
+        self._counts = None
+
+    def __len__(self):
+        return self.num_steps
+
+    def __iter__(self):
+        for i in range(self.num_steps):
+            yield self[i]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self.num_steps)
+            if start == 0 and step == 1:
+                return PairCountStore(self.path, stop)
+            return [self[i] for i in range(start, stop, step)]
+        if idx < 0:
+            idx += self.num_steps
+        if not 0 <= idx < self.num_steps:
+            raise IndexError(idx)
+        lo, hi = self._offsets[idx], self._offsets[idx + 1]
+        pairs, counts = self.pairs, self.counts()
+        return {
+            pairs[pid]: count
+            for pid, count in zip(self._pair_ids[lo:hi].tolist(), counts[lo:hi].tolist())
+        }
+
+    @property
+    def num_records(self):
+        return int(self._offsets[self.num_steps])
+
+    @property
+    def num_pairs(self):
+        return int(self._pair_cut[self.num_steps])
+
+    @property
+    def pairs(self):
+        """
+        The pair strings referenced by this view, indexed by pair id.
+        """
+        if self._pairs is None:
+            offsets = self._pair_offsets[: self.num_pairs + 1]
+            with (self.path / "pair_bytes.bin").open("rb") as f:
+                blob = f.read(int(offsets[-1]))
+            self._pairs = [
+                blob[lo:hi].decode("utf-8")
+                for lo, hi in zip(offsets[:-1].tolist(), offsets[1:].tolist())
+            ]
+        return self._pairs
+
+    def records(self):
+        """
+        Return (offsets, pair_ids, deltas) for the steps in this view.
+        """
+        n = self.num_records
+        return (
+            self._offsets[: self.num_steps + 1],
+            self._pair_ids[:n],
+            self._deltas[:n],
+        )
+
+    def counts(self):
+        """
+        Absolute pair count of every record in this view.
+        """
+        if self._counts is None:
+            _, pair_ids, deltas = self.records()
+            self._counts = grouped_cumsum(np.asarray(pair_ids), np.asarray(deltas))
+        return self._counts
+
+    def total(self, step=0):
+        """
+        Sum of all pair counts at the given step.
+        """
+        _, _, deltas = self.records()
+        return int(deltas[: self._offsets[step + 1]].sum())
+
+
+# one {pair: count} dict of all_pair_counts.json, with the separator before it
+_STEP = re.compile(rb'\s*,?\s*(\{(?:\s*"(?:[^"\\]|\\.)*"\s*:\s*-?\d+\s*,?)*\s*\})')
+
+
+def iter_pair_counts(path, num_steps=None, chunk_size=1 << 24):
+    """
+    Yield the {pair: count} dicts of an all_pair_counts.json file one step at a time, reading
+    only as much of the file as the first num_steps steps need.
+    """
+    with open(path, "rb") as f:
+        buf, eof = f.read(chunk_size), False
+        pos = buf.index(b"[") + 1
+        step = 0
+        while num_steps is None or step < num_steps:
+            m = _STEP.match(buf, pos)
+            if m is None:
+                if eof:
+                    if buf[pos:].strip() != b"]":
+                        raise ValueError(f"{path}: malformed pair counts after step {step}")
+                    return
+                # the step is cut off at the end of the buffer, read at least as much again
+                more = f.read(max(chunk_size, len(buf) - pos))
+                buf, pos, eof = buf[pos:] + more, 0, not more
+                continue
+            yield json.loads(m.group(1))
+            pos = m.end()
+            step += 1
+
+
+class PairCountFile:
+    """
+    all_pair_counts.json, parsed lazily one merge step at a time instead of with json.load.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def __iter__(self):
+        return iter_pair_counts(self.path)
+
+    def steps(self, num_steps=None):
+        return iter_pair_counts(self.path, num_steps)
+
+    def total(self, step=0):
+        """
+        Sum of all pair counts at the given step.
+        """
+        *_, counts = self.steps(step + 1)
+        return sum(counts.values())
+
+
+def write_pair_count_store(all_pair_counts, path, source=None):
+    """
+    Write the {pair: count} dicts of all_pair_counts.json (a list, or any iterable of them) to a
+    store. source is the file they were read from, recorded so that is_stale can tell when it
+    changes.
+    """
+    path = Path(path)
+    pair_to_id, pair_strings = {}, []
+    offsets, pair_cut = [0], [0]
+    pair_ids, deltas = [], []
+    last = {}
+    for step in all_pair_counts:
+        for pair, count in step.items():
+            pid = pair_to_id.get(pair)
+            if pid is None:
+                pid = pair_to_id[pair] = len(pair_strings)
+                pair_strings.append(pair)
+            pair_ids.append(pid)
+            deltas.append(count - last.get(pid, 0))
+            last[pid] = count
+        offsets.append(len(pair_ids))
+        pair_cut.append(len(pair_strings))
+
+    encoded = [pair.encode("utf-8") for pair in pair_strings]
+    pair_offsets = np.zeros(len(encoded) + 1, np.int64)
+    np.cumsum([len(b) for b in encoded], out=pair_offsets[1:])
+
+    # write to a scratch directory first so a crashed conversion never leaves a partial store
+    tmp = path.with_name(path.name + ".tmp")
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir(parents=True)
+    np.save(tmp / "offsets.npy", np.array(offsets, np.int64))
+    np.save(tmp / "pair_ids.npy", np.array(pair_ids, np.int32))
+    np.save(tmp / "deltas.npy", np.array(deltas, np.int64))
+    np.save(tmp / "pair_cut.npy", np.array(pair_cut, np.int64))
+    np.save(tmp / "pair_offsets.npy", pair_offsets)
+    with (tmp / "pair_bytes.bin").open("wb") as f:
+        f.write(b"".join(encoded))
+    with (tmp / "meta.json").open("w") as f:
+        meta = dict(
+            version=STORE_VERSION,
+            num_steps=len(offsets) - 1,
+            num_pairs=len(pair_strings),
+            num_records=len(pair_ids),
+        )
+        if source is not None:
+            meta["source"] = source
+        json.dump(meta, f, indent=5)
+
+    if path.exists():
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+    return meta
+
+
+def convert_category(category_dir, overwrite=False):
+    category_dir = Path(category_dir)
+    out = store_path(category_dir)
+    if (out / "meta.json").exists() and not overwrite and not is_stale(category_dir):
+        return None
+    source = category_dir / "all_pair_counts.json"
+    # taken before reading, so a dump that lands during the conversion makes the store stale
+    stat = source_stat(source)
+    return write_pair_count_store(PairCountFile(source), out, source=stat)
+
+
+@click.command()
+@click.option(
+    '--experiment_dir',
+    type=str,
+    default='data/mixed_languages/n_10/0'
+)
+@click.option(
+    '--variant',
+    type=str,
+    default=None,
+    help='Convert this subdir of every category (e.g. a num_bytes variant) instead of the category dir itself.'
+)
+@click.option(
+    '--overwrite',
+    is_flag=True,
+    help='Rebuild stores that already exist (stale ones are always rebuilt).'
+)
+@click.option(
+    '--remove_json',
+    is_flag=True,
+    help='Delete all_pair_counts.json after a successful conversion.'
+)
+def main(experiment_dir: str, variant: str, overwrite: bool, remove_json: bool):
+    experiment_dir = Path(experiment_dir)
+    for category_dir in sorted(experiment_dir.iterdir()):
+        if not category_dir.is_dir() or category_dir.name.startswith("."):
+            continue
+        if variant is not None:
+            category_dir = category_dir / variant
+        if not (category_dir / "all_pair_counts.json").exists():
+            continue
+
+        meta = convert_category(category_dir, overwrite=overwrite)
+        if meta is None:
+            print(f'{category_dir}: store exists, skipping', flush=True)
+            continue
+        print(
+            f'{category_dir}: {meta["num_steps"]} steps, {meta["num_pairs"]} pairs, {meta["num_records"]} records',
+            flush=True,
+        )
+
+        if remove_json:
+            # only drop the JSON once the store reads back identically
+            with (category_dir / "all_pair_counts.json").open() as f:
+                assert json.load(f) == list(PairCountStore(store_path(category_dir)))
+            os.remove(category_dir / "all_pair_counts.json")
+
+
+if __name__ == '__main__':
+    main()
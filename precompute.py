@@ -0,0 +1,633 @@
+"""
+Vectorized precomputation for lazy_optimize.
+
+Every category's pair counts are flattened once into COO triplets (step, category, pair, count),
+and all solver structures are derived from them by sorting and differencing, instead of by
+walking the per-step dicts in Python.
+
+Counts are stored sparse and as int32 where they fit: most pairs have no delta in most
+categories at a given step, and the mixture products are done as sparse mat-vecs.
+"""
+
+import sys
+import time
+from array import array
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import partial
+
+import numpy as np
+import scipy.sparse as sp
+import tqdm.auto as tqdm
+
+from pair_store import PairCountFile, PairCountStore
+
+
+def compact_counts(counts):
+    """
+    counts as int32 if every value fits, int64 otherwise.
+    """
+    info = np.iinfo(np.int32)
+    if len(counts) and (counts.min() < info.min or counts.max() > info.max):
+        return counts.astype(np.int64)
+    return counts.astype(np.int32)
+
+
+def nbytes(a):
+    if sp.issparse(a):
+        return a.data.nbytes + a.indices.nbytes + a.indptr.nbytes
+    return a.nbytes
+
+
+def transcript_dict_nbytes(num_keys, num_records):
+    """
+    Estimated size of the dict of transcripts the solver used to build, mapping every
+    (category, pair id) to a list of (step, count) tuples. Pair ids and steps are shared ints,
+    but every count is its own int object (small ints are cached, so this errs high).
+    """
+    pair, integer = sys.getsizeof((0, 0)), sys.getsizeof(2**20)
+    # a dict entry is a hash and two pointers, with the index kept at most 2/3 full
+    entry = 3 * 8 * 3 // 2
+    per_key = entry + pair + sys.getsizeof([])
+    # a list slot, the (step, count) tuple and the count
+    per_record = 8 + pair + integer
+    return per_key * num_keys + per_record * num_records
+
+
+class DeltaCounts:
+    """
+    The count changes between consecutive merge steps, in CSR layout by step: the deltas into
+    step i + 1 are the rows indptr[i]:indptr[i + 1] of counts, a sparse (rows, num_langs)
+    matrix, and pair_ids holds the pair of every row.
+    """
+
+    def __init__(self, pair_ids, indptr, counts):
+        self.pair_ids = pair_ids
+        self.indptr = indptr
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, i):
+        """
+        The pairs changed at step i and their dense (num_langs, k) deltas.
+        """
+        lo, hi = self.indptr[i], self.indptr[i + 1]
+        return self.pair_ids[lo:hi], self.counts[lo:hi].T.toarray()
+
+    def mixed(self, mix, start, stop):
+        """
+        mix @ deltas for all of steps start..stop-1 at once, as one vector aligned with
+        pair_ids[indptr[start]:indptr[stop]].
+        """
+        lo, hi = self.indptr[start], self.indptr[stop]
+        return self.counts[lo:hi] @ mix
+
+    def select_langs(self, lang_idx):
+        counts = self.counts[:, lang_idx]
+        counts.eliminate_zeros()
+        return DeltaCounts(self.pair_ids, self.indptr, counts)
+
+    def combine_langs(self, membership):
+        counts = sp.csr_matrix(self.counts.astype(np.int64) @ membership)
+        counts.eliminate_zeros()
+        counts.data = compact_counts(counts.data)
+        return DeltaCounts(self.pair_ids, self.indptr, counts)
+
+    def drop_pairs(self, keep, new_id):
+        rows = keep[self.pair_ids]
+        indptr = np.r_[0, np.cumsum(rows)][self.indptr]
+        return DeltaCounts(new_id[self.pair_ids[rows]].astype(np.int32), indptr, self.counts[rows])
+
+    @property
+    def nbytes(self):
+        return self.pair_ids.nbytes + self.indptr.nbytes + nbytes(self.counts)
+
+
+class CountIndex:
+    """
+    The count of every (pair, category) at every merge step, stored as one sorted array of
+    (pair, category, step) keys with the count recorded at that step. The counts of a batch of
+    pairs in all categories at step i are then found with a single searchsorted.
+    """
+
+    def __init__(self, pair_ids, lang_idx, steps, counts, num_langs, num_steps):
+        self.num_langs, self.num_steps = num_langs, max(num_steps, 1)
+        keys = (pair_ids * num_langs + lang_idx) * self.num_steps + steps
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.counts = counts[order]
+
+    def counts_at(self, step, pair_ids):
+        """
+        Return the (len(pair_ids), num_langs) matrix of counts at the given step.
+        """
+        if not len(self.keys):
+            return np.zeros((len(pair_ids), self.num_langs), np.int64)
+        rows = np.asarray(pair_ids, np.int64)[:, None] * self.num_langs + np.arange(
+            self.num_langs
+        )
+        lo = rows * self.num_steps
+        idx = np.searchsorted(self.keys, lo + step, side="right") - 1
+        # the last record at or before step, unless it belongs to an earlier (pair, category)
+        found = self.keys[np.maximum(idx, 0)] >= lo
+        found &= idx >= 0
+        return np.where(found, self.counts[idx], 0)
+
+    def counts_at_steps(self, steps, pair_ids):
+        """
+        Like counts_at, with a step per pair.
+        """
+        if not len(self.keys):
+            return np.zeros((len(pair_ids), self.num_langs), np.int64)
+        rows = np.asarray(pair_ids, np.int64)[:, None] * self.num_langs + np.arange(
+            self.num_langs
+        )
+        lo = rows * self.num_steps
+        idx = np.searchsorted(self.keys, lo + np.asarray(steps, np.int64)[:, None], side="right") - 1
+        found = self.keys[np.maximum(idx, 0)] >= lo
+        found &= idx >= 0
+        return np.where(found, self.counts[idx], 0)
+
+    def num_runs(self):
+        """
+        Number of (pair, category) with at least one record.
+        """
+        rows = self.keys // self.num_steps
+        return int(len(rows) > 0) + int(np.count_nonzero(rows[1:] != rows[:-1]))
+
+    def snapshot(self, step, num_pairs):
+        """
+        The counts of all pairs at the given step, as a sparse (num_pairs, num_langs) matrix.
+        """
+        rows, steps = np.divmod(self.keys, self.num_steps)
+        # records of a (pair, category) are sorted by step, so the ones at or before step form
+        # a prefix of the run, and the last of them holds the current count
+        upto = steps <= step
+        next_upto = np.r_[upto[1:] & (rows[1:] == rows[:-1]), False]
+        last = upto & ~next_upto
+        pairs, langs = np.divmod(rows[last], self.num_langs)
+        return sp.csr_matrix(
+            (self.counts[last], (pairs, langs)), shape=(num_pairs, self.num_langs)
+        )
+
+    def select_langs(self, lang_idx):
+        """
+        The index restricted to the given categories, renumbered in the given order.
+        """
+        new_lang = np.full(self.num_langs, -1, np.int64)
+        new_lang[lang_idx] = np.arange(len(lang_idx))
+        rows, steps = np.divmod(self.keys, self.num_steps)
+        pairs, langs = np.divmod(rows, self.num_langs)
+        keep = new_lang[langs] >= 0
+        return CountIndex(
+            pairs[keep],
+            new_lang[langs[keep]],
+            steps[keep],
+            self.counts[keep],
+            len(lang_idx),
+            self.num_steps,
+        )
+
+    def combine_langs(self, group_of):
+        """
+        The index over groups of categories, where group_of[j] is the group of category j and a
+        group's count is the sum of its members' counts.
+        """
+        num_groups = int(group_of.max()) + 1 if len(group_of) else 0
+        rows, steps = np.divmod(self.keys, self.num_steps)
+        pairs, langs = np.divmod(rows, self.num_langs)
+        if not len(rows):
+            return CountIndex(pairs, langs, steps, self.counts, num_groups, self.num_steps)
+
+        # records of a (pair, category) are sorted by step, difference them into count changes
+        counts = self.counts.astype(np.int64)
+        delta = counts - np.r_[0, counts[:-1]]
+        starts = group_starts(rows)
+        delta[starts] = counts[starts]
+
+        # changes of all members at the same step add up, then accumulate along each run
+        keys = (pairs * num_groups + group_of[langs]) * self.num_steps + steps
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        starts = group_starts(keys)
+        totals = np.cumsum(np.add.reduceat(delta[order], starts))
+        keys = keys[starts]
+        runs = group_starts(keys // self.num_steps)
+        run_offsets = np.r_[0, totals[runs[1:] - 1]]
+        totals -= np.repeat(run_offsets, np.diff(np.r_[runs, len(keys)]))
+
+        rows, steps = np.divmod(keys, self.num_steps)
+        pairs, groups = np.divmod(rows, num_groups)
+        return CountIndex(
+            pairs, groups, steps, compact_counts(totals), num_groups, self.num_steps
+        )
+
+    def drop_pairs(self, keep, new_id):
+        rows, steps = np.divmod(self.keys, self.num_steps)
+        pairs, langs = np.divmod(rows, self.num_langs)
+        kept = keep[pairs]
+        return CountIndex(
+            new_id[pairs[kept]],
+            langs[kept],
+            steps[kept],
+            self.counts[kept],
+            self.num_langs,
+            self.num_steps,
+        )
+
+    def pair_ids(self):
+        """
+        The ids of all pairs that have at least one record.
+        """
+        return np.unique(self.keys // (self.num_langs * self.num_steps))
+
+
+@dataclass
+class Precomputation:
+    pair_to_id: dict
+    id_to_pair: list
+    initial_cut: int
+    initial_pair_array: sp.csr_matrix
+    delta_count_arrays: DeltaCounts
+    count_index: CountIndex
+    # (step, pair id) of every category's first record, (num_steps, -1) if it has none
+    first_records: np.ndarray
+    timing: dict = field(default_factory=dict)
+
+    def initial_prios(self, mix):
+        """
+        mix @ counts at step 0 for every pair, zero for pairs that first appear later.
+        """
+        prios = np.zeros(len(self.id_to_pair))
+        prios[: self.initial_cut] = self.initial_pair_array.T @ mix
+        return prios
+
+    def skipped_pair(self):
+        """
+        The pair lazy_optimize never constrains: the first pair in these categories, which is
+        pair 0 when they are precomputed on their own. None if there are no records.
+        """
+        steps, pairs = self.first_records.T
+        if not len(pairs) or pairs.max() < 0:
+            return None
+        # categories without records come last, and argmin picks the first category among
+        # those that start at the same step
+        return int(pairs[np.argmin(steps)])
+
+    def merge_ids(self, merges):
+        """
+        Pair id of every merge, or None for merges that can't be constrained: those that never
+        occur as a pair, and the skipped pair.
+        """
+        skipped = self.skipped_pair()
+        ids = [self.pair_to_id.get(str(merge)) for merge in merges]
+        return [None if pid == skipped else pid for pid in ids]
+
+    def memory_report(self):
+        """
+        Bytes held by each solver array, next to what the previous layout (dense float64
+        matrices, and a dict of (step, count) tuple lists for the counts over time) would need.
+        """
+        num_langs = self.initial_pair_array.shape[0]
+        dca = self.delta_count_arrays
+        index = self.count_index
+        return dict(
+            initial_pair_array=(
+                nbytes(self.initial_pair_array),
+                8 * num_langs * self.initial_cut,
+            ),
+            delta_count_arrays=(
+                dca.nbytes,
+                # int64 pair ids and a dense float64 block per step
+                (8 + 8 * num_langs) * len(dca.pair_ids),
+            ),
+            count_index=(
+                index.keys.nbytes + index.counts.nbytes,
+                transcript_dict_nbytes(index.num_runs(), len(index.keys)),
+            ),
+        )
+
+    def select_langs(self, lang_idx):
+        """
+        The precomputation for a subset of the categories, given by their indices in the order
+        they should appear in. Pair ids are kept, but pairs that have no records in the subset
+        are dropped from pair_to_id, as they would be when precomputing for the subset alone,
+        and the skipped pair is the subset's first one.
+        """
+        lang_idx = np.asarray(lang_idx, np.int64)
+        count_index = self.count_index.select_langs(lang_idx)
+        present = count_index.pair_ids().tolist()
+        return Precomputation(
+            pair_to_id={self.id_to_pair[pid]: pid for pid in present},
+            id_to_pair=self.id_to_pair,
+            initial_cut=self.initial_cut,
+            initial_pair_array=self.initial_pair_array[lang_idx],
+            delta_count_arrays=self.delta_count_arrays.select_langs(lang_idx),
+            count_index=count_index,
+            first_records=self.first_records[lang_idx],
+            timing=self.timing,
+        )
+
+    def dominated_pairs(self, mids):
+        """
+        Mask of the pairs that can never beat the merge: at every merge step i (with merge pair
+        mids[i]) their count is at most the merge's count in every category, so no mixture
+        makes them a violated competitor. Merge pairs and the first pair of every category
+        (one of which is the skipped pair of any subset, see select_langs) are never dominated.
+        """
+        index = self.count_index
+        num_steps, num_langs = index.num_steps, index.num_langs
+        valid = [i for i, mid in enumerate(mids) if mid is not None]
+        # steps without a constraint bound nothing
+        merge_counts = np.full((num_steps, num_langs), np.inf)
+        if valid:
+            merge_counts[valid] = index.counts_at_steps(valid, [mids[i] for i in valid])
+
+        # every record holds its count until the next record of its (pair, category)
+        rows, steps = np.divmod(index.keys, num_steps)
+        pairs, langs = np.divmod(rows, num_langs)
+        ends = np.r_[steps[1:], num_steps]
+        ends[np.r_[rows[1:] != rows[:-1], True]] = num_steps
+        ok = np.ones(len(rows), bool)
+        for j in range(num_langs):
+            sel = np.flatnonzero(langs == j)
+            ok[sel] = index.counts[sel] <= range_min(merge_counts[:, j], steps[sel], ends[sel])
+
+        dominated = np.ones(len(self.id_to_pair), bool)
+        dominated[pairs[~ok]] = False
+        dominated[[mid for mid in mids if mid is not None]] = False
+        firsts = self.first_records[:, 1]
+        dominated[firsts[firsts >= 0]] = False
+        return dominated
+
+    def drop_pairs(self, keep):
+        """
+        The precomputation without the pairs where keep is False. The remaining pairs keep
+        their order, so ties in separation are broken the same way.
+        """
+        new_id = np.cumsum(keep) - 1
+        id_to_pair = [pair for pair, kept in zip(self.id_to_pair, keep.tolist()) if kept]
+        initial_keep = keep[: self.initial_cut]
+        first_records = self.first_records.copy()
+        firsts = first_records[:, 1]
+        present = firsts >= 0
+        firsts[present] = np.where(keep[firsts[present]], new_id[firsts[present]], -1)
+        return Precomputation(
+            pair_to_id={
+                pair: int(new_id[pid]) for pair, pid in self.pair_to_id.items() if keep[pid]
+            },
+            id_to_pair=id_to_pair,
+            initial_cut=int(initial_keep.sum()),
+            initial_pair_array=self.initial_pair_array[:, np.flatnonzero(initial_keep)],
+            delta_count_arrays=self.delta_count_arrays.drop_pairs(keep, new_id),
+            count_index=self.count_index.drop_pairs(keep, new_id),
+            first_records=first_records,
+            timing=self.timing,
+        )
+
+    def combine_langs(self, groups):
+        """
+        The precomputation over groups of categories, given as lists of category indices, where
+        each group's counts are the sums of its members' counts. Singleton groups keep a
+        category as it is.
+        """
+        num_langs = self.initial_pair_array.shape[0]
+        group_of = np.full(num_langs, -1, np.int64)
+        for g, members in enumerate(groups):
+            group_of[members] = g
+        if (group_of < 0).any():
+            raise ValueError("every category needs to be in exactly one group")
+        membership = sp.csr_matrix(
+            (np.ones(num_langs, np.int64), (np.arange(num_langs), group_of)),
+            shape=(num_langs, len(groups)),
+        )
+        initial_pair_array = sp.csr_matrix(membership.T @ self.initial_pair_array.astype(np.int64))
+        initial_pair_array.data = compact_counts(initial_pair_array.data)
+        # a group starts with the record of its member that starts first
+        steps = self.first_records[:, 0]
+        first_records = self.first_records[
+            [min(members, key=lambda j: (steps[j], j)) for members in groups]
+        ]
+        return Precomputation(
+            pair_to_id=self.pair_to_id,
+            id_to_pair=self.id_to_pair,
+            initial_cut=self.initial_cut,
+            initial_pair_array=initial_pair_array,
+            delta_count_arrays=self.delta_count_arrays.combine_langs(membership),
+            count_index=self.count_index.combine_langs(group_of),
+            first_records=first_records,
+            timing=self.timing,
+        )
+
+
+def range_min(values, starts, stops):
+    """
+    min(values[start:stop]) for every (start, stop) pair, with a sparse table.
+    """
+    table = [values]
+    while 2 ** len(table) <= len(values):
+        prev, half = table[-1], 2 ** (len(table) - 1)
+        table.append(np.minimum(prev[:-half], prev[half:]))
+    level = np.log2(stops - starts).astype(np.int64)
+    out = np.empty(len(starts))
+    for k in np.unique(level).tolist():
+        sel = level == k
+        out[sel] = np.minimum(table[k][starts[sel]], table[k][stops[sel] - 2**k])
+    return out
+
+
+def prune_dominated(pre, merges, num_merges, verbose=True):
+    """
+    Drop the pairs that are dominated by the merge at every step (see
+    Precomputation.dominated_pairs) and report how much of the pair universe and the delta
+    rows went with them.
+    """
+    start = time.perf_counter()
+    mids = pre.merge_ids(merges[:num_merges])
+    pruned = pre.drop_pairs(~pre.dominated_pairs(mids))
+    pruned.timing = dict(pre.timing, dominance_pruning=time.perf_counter() - start)
+    if verbose:
+        num_pairs, num_rows = len(pre.id_to_pair), len(pre.delta_count_arrays.pair_ids)
+        dropped = num_pairs - len(pruned.id_to_pair)
+        dropped_rows = num_rows - len(pruned.delta_count_arrays.pair_ids)
+        print(
+            f"dominance pruning: dropped {dropped} of {num_pairs} pairs "
+            f"({100 * dropped / max(num_pairs, 1):.1f}%) and {dropped_rows} of {num_rows} delta "
+            f"rows ({100 * dropped_rows / max(num_rows, 1):.1f}%) "
+            f"in {pruned.timing['dominance_pruning']:.3f}s"
+        )
+    return pruned
+
+
+@contextmanager
+def timed(timing, name, verbose=True):
+    start = time.perf_counter()
+    yield
+    timing[name] = time.perf_counter() - start
+    if verbose:
+        print(f"{name}: {timing[name]:.3f}s")
+
+
+def category_records(apc, num_steps):
+    """
+    Flatten the first num_steps entries of a category's pair counts into
+    (steps, local pair ids, counts, local pair strings, steps read), in file order.
+    """
+    if isinstance(apc, PairCountStore):
+        view = apc[:num_steps]
+        offsets, pair_ids, _ = view.records()
+        steps = np.repeat(np.arange(len(view), dtype=np.int64), np.diff(offsets))
+        return steps, np.asarray(pair_ids, np.int64), view.counts(), view.pairs, len(view)
+
+    # a streamed file is parsed step by step here, typed arrays keep the records compact
+    step_dicts = apc.steps(num_steps) if isinstance(apc, PairCountFile) else apc[:num_steps]
+    local, steps, pair_ids, counts = {}, array("q"), array("q"), array("q")
+    num_read = 0
+    for i, pc in enumerate(step_dicts):
+        num_read += 1
+        pair_ids.extend(local.setdefault(pair, len(local)) for pair in pc)
+        counts.extend(pc.values())
+        steps.extend([i] * len(pc))
+    return (
+        np.frombuffer(steps, np.int64),
+        np.frombuffer(pair_ids, np.int64),
+        np.frombuffer(counts, np.int64),
+        list(local),
+        num_read,
+    )
+
+
+def group_starts(keys):
+    """
+    Start index of every run of equal values in a sorted array.
+    """
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+
+def precompute(pair_counts, num_merges, verbose=True):
+    P = partial(tqdm.tqdm, dynamic_ncols=True) if verbose else lambda x, **_: x
+    langs = list(pair_counts.keys())
+    num_langs = len(langs)
+    timing = {}
+
+    with timed(timing, "reading records", verbose):
+        union, uids, steps, lang_idx, pos, counts = {}, [], [], [], [], []
+        # (step, union id) of every category's first record
+        firsts = np.full((num_langs, 2), [num_merges, -1], np.int64)
+        for j, (name, apc) in enumerate(P(pair_counts.items(), desc="reading records")):
+            s, local_ids, c, local_pairs, num_read = category_records(apc, num_merges)
+            if num_read < num_merges:
+                print(f"warning: insufficient merges for lang \"{name}\": {num_read}")
+            to_union = np.array(
+                [union.setdefault(pair, len(union)) for pair in local_pairs], np.int64
+            )
+            uids.append(to_union[local_ids])
+            if len(s):
+                firsts[j] = s[0], uids[-1][0]
+            steps.append(s)
+            lang_idx.append(np.full(len(s), j, np.int64))
+            pos.append(np.arange(len(s), dtype=np.int64))
+            counts.append(c)
+
+        # COO triplets in the order the original loops visit them: by step, then category,
+        # then position in the category's dict
+        order = np.lexsort(
+            (np.concatenate(pos), np.concatenate(lang_idx), np.concatenate(steps))
+        )
+        uid = np.concatenate(uids)[order]
+        step = np.concatenate(steps)[order]
+        lang = np.concatenate(lang_idx)[order]
+        count = np.concatenate(counts)[order]
+        # the per-category arrays are as large as the triplets, don't keep both around
+        del uids, steps, lang_idx, pos, counts, order
+
+    with timed(timing, "mapping pairs", verbose):
+        # pair ids are assigned in order of first appearance
+        uniq, first = np.unique(uid, return_index=True)
+        by_first = uniq[np.argsort(first)]
+        gid_of_uid = np.empty(len(union), np.int64)
+        gid_of_uid[by_first] = np.arange(len(by_first))
+        pid = gid_of_uid[uid]
+        present = firsts[:, 1] >= 0
+        firsts[present, 1] = gid_of_uid[firsts[present, 1]]
+
+        union_pairs = list(union)
+        id_to_pair = [union_pairs[u] for u in by_first.tolist()]
+        pair_to_id = {pair: i for i, pair in enumerate(id_to_pair)}
+        num_pairs = len(id_to_pair)
+        initial_cut = int(pid[step == 0].max()) + 1 if (step == 0).any() else 0
+
+    with timed(timing, "building IPA", verbose):
+        at0 = step == 0
+        initial_pair_array = sp.csr_matrix(
+            (compact_counts(count[at0]), (lang[at0], pid[at0])),
+            shape=(num_langs, initial_cut),
+        )
+
+    with timed(timing, "taking deltas", verbose):
+        # sort by (category, pair) keeping step order, then difference within each run
+        lp_key = lang * num_pairs + pid
+        lp_order = np.argsort(lp_key, kind="stable")
+        lp_sorted = lp_key[lp_order]
+        lp_starts = group_starts(lp_sorted)
+        sorted_counts = count[lp_order]
+        prev = np.r_[0, sorted_counts[:-1]]
+        prev[lp_starts] = 0
+        delta = np.empty_like(count)
+        delta[lp_order] = sorted_counts - prev
+
+    with timed(timing, "building DCA", verbose):
+        later = step >= 1
+        d_step, d_lang, d_pid, d_delta = step[later], lang[later], pid[later], delta[later]
+
+        # one column per (step, pair), ordered by step and then first appearance in the step
+        sp_key = d_step * num_pairs + d_pid
+        sp_uniq, sp_first, sp_inv = np.unique(
+            sp_key, return_index=True, return_inverse=True
+        )
+        col_order = np.argsort(sp_first)
+        col = np.empty(len(sp_uniq), np.int64)
+        col[col_order] = np.arange(len(sp_uniq))
+        col_keys = sp_uniq[col_order] % num_pairs
+        col_steps = sp_uniq[col_order] // num_pairs
+
+        nonzero = d_delta != 0
+        values = sp.csr_matrix(
+            (
+                compact_counts(d_delta[nonzero]),
+                (col[sp_inv.reshape(-1)][nonzero], d_lang[nonzero]),
+            ),
+            shape=(len(sp_uniq), num_langs),
+        )
+
+        # indptr over merge steps, delta_count_arrays[i] holds the deltas into step i + 1
+        indptr = np.searchsorted(col_steps, np.arange(1, num_merges + 1))
+        delta_count_arrays = DeltaCounts(col_keys.astype(np.int32), indptr, values)
+
+    with timed(timing, "building count index", verbose):
+        count_index = CountIndex(pid, lang, step, compact_counts(count), num_langs, num_merges)
+
+    pre = Precomputation(
+        pair_to_id=pair_to_id,
+        id_to_pair=id_to_pair,
+        initial_cut=initial_cut,
+        initial_pair_array=initial_pair_array,
+        delta_count_arrays=delta_count_arrays,
+        count_index=count_index,
+        first_records=firsts,
+        timing=timing,
+    )
+    if verbose:
+        print(f"precomputation: {sum(timing.values()):.3f}s total")
+        print_memory_report(pre.memory_report())
+    return pre
+
+
+def print_memory_report(report):
+    total, dense_total = 0, 0
+    for name, (size, dense) in report.items():
+        print(f"{name}: {size / 2**20:.1f} MB (previously {dense / 2**20:.1f} MB)")
+        total, dense_total = total + size, dense_total + dense
+    print(f"solver arrays: {total / 2**20:.1f} MB (previously {dense_total / 2**20:.1f} MB)")
@@ -0,0 +1,128 @@
+"""
+On-disk cache of the precomputation, so repeat solves of an unchanged experiment skip it.
+
+The arrays of a Precomputation are written uncompressed to precompute_[merges]_[key].npz in the
+experiment dir. The key hashes the cache version, num_merges, the categories in order, and the
+path, size and modification time of merges.txt and of every category's pair count files, so a
+re-dumped category or a different language list gets a fresh entry. Entries are never removed
+automatically; delete the precompute_*.npz files to reclaim the space.
+"""
+
+import hashlib
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import scipy.sparse as sp
+
+from pair_store import store_path
+from precompute import CountIndex, DeltaCounts, Precomputation, precompute
+
+CACHE_VERSION = 2
+
+
+def input_files(root, langs, variant=None):
+    root = Path(root)
+    files = [root / "merges.txt"]
+    for lang in langs:
+        item = root / lang if variant is None else root / lang / variant
+        store = store_path(item)
+        files += [item / "all_pair_counts.json", item / "meta.json"]
+        if store.exists():
+            files += sorted(store.iterdir())
+    return [f for f in files if f.exists()]
+
+
+def cache_key(root, langs, num_merges, variant=None):
+    h = hashlib.sha256(f"{CACHE_VERSION}:{num_merges}:{list(langs)}".encode())
+    for f in input_files(root, langs, variant):
+        stat = f.stat()
+        h.update(f"{f.resolve()}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return h.hexdigest()[:20]
+
+
+def cache_path(root, langs, num_merges, variant=None):
+    return Path(root) / f"precompute_{num_merges}_{cache_key(root, langs, num_merges, variant)}.npz"
+
+
+def save_precomputation(path, pre):
+    encoded = [pair.encode("utf-8") for pair in pre.id_to_pair]
+    pair_offsets = np.zeros(len(encoded) + 1, np.int64)
+    np.cumsum([len(b) for b in encoded], out=pair_offsets[1:])
+    ipa, dca, index = pre.initial_pair_array, pre.delta_count_arrays, pre.count_index
+    arrays = dict(
+        version=np.array(CACHE_VERSION),
+        pair_bytes=np.frombuffer(b"".join(encoded), np.uint8),
+        pair_offsets=pair_offsets,
+        # pair_to_id can hold fewer pairs than id_to_pair (see Precomputation.select_langs)
+        present=np.array(sorted(pre.pair_to_id.values()), np.int64),
+        initial_cut=np.array(pre.initial_cut),
+        ipa_data=ipa.data,
+        ipa_indices=ipa.indices,
+        ipa_indptr=ipa.indptr,
+        ipa_shape=np.array(ipa.shape),
+        dca_pair_ids=dca.pair_ids,
+        dca_indptr=dca.indptr,
+        dca_data=dca.counts.data,
+        dca_indices=dca.counts.indices,
+        dca_row_ptr=dca.counts.indptr,
+        dca_shape=np.array(dca.counts.shape),
+        index_keys=index.keys,
+        index_counts=index.counts,
+        index_shape=np.array([index.num_langs, index.num_steps]),
+        first_records=pre.first_records,
+    )
+    # written under a temporary name so a killed run never leaves a truncated cache entry
+    tmp = path.with_name(path.stem + ".tmp.npz")
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+def load_precomputation(path):
+    with np.load(path) as f:
+        if int(f["version"]) != CACHE_VERSION:
+            raise ValueError(f"{path}: unsupported cache version {int(f['version'])}")
+        blob, offsets = f["pair_bytes"].tobytes(), f["pair_offsets"].tolist()
+        id_to_pair = [blob[lo:hi].decode("utf-8") for lo, hi in zip(offsets[:-1], offsets[1:])]
+        index = CountIndex.__new__(CountIndex)
+        index.keys, index.counts = f["index_keys"], f["index_counts"]
+        index.num_langs, index.num_steps = f["index_shape"].tolist()
+        return Precomputation(
+            pair_to_id={id_to_pair[pid]: pid for pid in f["present"].tolist()},
+            id_to_pair=id_to_pair,
+            initial_cut=int(f["initial_cut"]),
+            initial_pair_array=sp.csr_matrix(
+                (f["ipa_data"], f["ipa_indices"], f["ipa_indptr"]), shape=tuple(f["ipa_shape"])
+            ),
+            delta_count_arrays=DeltaCounts(
+                f["dca_pair_ids"],
+                f["dca_indptr"],
+                sp.csr_matrix(
+                    (f["dca_data"], f["dca_indices"], f["dca_row_ptr"]),
+                    shape=tuple(f["dca_shape"]),
+                ),
+            ),
+            count_index=index,
+            first_records=f["first_records"],
+        )
+
+
+def cached_precompute(root, pair_counts, num_merges, variant=None, verbose=True):
+    """
+    precompute, loading the result from the experiment's cache if the inputs are unchanged and
+    writing it there otherwise.
+    """
+    path = cache_path(root, list(pair_counts.keys()), num_merges, variant)
+    if path.exists():
+        start = time.perf_counter()
+        pre = load_precomputation(path)
+        pre.timing = dict(cache_load=time.perf_counter() - start)
+        if verbose:
+            print(f"loaded precomputation from {path} in {pre.timing['cache_load']:.3f}s")
+        return pre
+    pre = precompute(pair_counts, num_merges, verbose=verbose)
+    save_precomputation(path, pre)
+    if verbose:
+        print(f"cached precomputation in {path}")
+    return pre
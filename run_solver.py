@@ -1,18 +1,40 @@
 import argparse
-import bisect
+import glob
+import multiprocessing as mp
+import resource
 import sys
 import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
 from functools import partial
 from pathlib import Path
 
-import gurobipy as gp
 import numpy as np
 import simdjson as json
 import tqdm.auto as tqdm
-from gurobipy import GRB
 
-from prqrs import PriorityQueue
-from utils import load_data
+from approx import approx_optimize, approximate_mixture
+from checkpoint import (
+    checkpoint_path,
+    load_checkpoint,
+    pairs_digest,
+    save_checkpoint,
+    write_json_atomic,
+)
+from colgen import REDUCED_COST_TOL, initial_columns, price_category
+from lp_backend import BACKENDS, make_backend
+from pair_store import has_pair_counts, store_path
+from precompute import precompute, prune_dominated
+from precompute_cache import cached_precompute
+from schedule import SCHEDULES, make_schedule
+from separation import Scanner, make_scanner, revalidate
+from utils import load_data, load_langlist
+
+# largest share of a time budget that is kept for the final diagnostics scan
+DIAGNOSTICS_SHARE = 0.25
 
 
 def lazy_optimize(
@@ -25,7 +47,60 @@ def lazy_optimize(
     max_iters=300000000,
     max_add=100,
     debug=False,
+    backend="gurobi",
+    workers=1,
+    snapshot_interval=None,
+    checkpoint=None,
+    checkpoint_every=10,
+    resume=False,
+    profile=None,
+    pre=None,
+    seed=None,
+    warm_start=False,
+    prune_after=None,
+    schedule="fixed",
+    duals=False,
+    pipeline=False,
+    time_budget=None,
+    deadline=None,
+    intermediate=None,
+    merge_steps=None,
 ):
+    """
+    If pre is given it is used instead of precomputing, and may cover more than num_merges
+    merges. seed is a list of constraint blocks (as returned in "blocks") from a solve over a
+    shorter merge prefix or another subset of the categories. The blocks that are valid here
+    are added to the model before separation starts. With warm_start, separation starts from
+    the mixture found by approx.approximate_mixture, seeded with its tight constraints. With
+    prune_after, constraints that stay non-binding for that many solves are removed from the
+    model, and can be added back by separation. schedule picks how competitor_batch_size and
+    max_add evolve over the epochs (see schedule.py). With duals, the solution also holds the
+    dual of the sum-to-one row and the duals of the rows of every block (for colgen.py). With
+    pipeline, a background thread scans again at the current mixture while the LP solves, and
+    the next epoch adds the constraints it found that are still violated at the new mixture,
+    without scanning. A full scan only runs when none of them are. With time_budget (seconds
+    from the call) or deadline (a time.perf_counter() value, for a budget shared by several
+    solves), the scans and LP solves are cut off early enough to leave time for the final scan
+    (estimated from the scans so far, at most DIAGNOSTICS_SHARE of the budget), and the last
+    mixture is returned with diagnostics that report how many merges it leaves violated. If the
+    final scan is cut off at the deadline as well, the merges it didn't get to are reported as
+    unchecked. With intermediate, the mixture after every epoch is written to that
+    file. With merge_steps, constraints are only generated for the merges at those steps
+    (priorities still advance through every step), and the diagnostics count the violated
+    merges over all of them.
+    """
+    if time_budget is not None:
+        deadline = min(time.perf_counter() + time_budget, np.inf if deadline is None else deadline)
+
+    run_start = time.perf_counter()
+    # seconds before the deadline at which the optimization stops, for the diagnostics scan
+    reserve = 0.0
+
+    def expired(final=False):
+        if deadline is None:
+            return False
+        return time.perf_counter() > deadline - (0.0 if final else reserve)
+
     langs = list(pair_counts.keys())
     num_langs = len(pair_counts)
     merge_subset = [str(merge) for merge in merges[:num_merges]]
@@ -34,231 +109,358 @@ def lazy_optimize(
     if verbose:
         print("precomputation")
 
-    for lang, apc in pair_counts.items():
-        if len(apc) < num_merges:
-            print(f"warning: insufficient merges for lang \"{lang}\": {len(apc)}")
-
-    # Build the pair maps
-    pair_to_id, id_to_pair = {}, []
-    for i in P(range(num_merges), desc="mapping pairs"):
-        for lang, apc in pair_counts.items():
-            if i < len(apc):
-                for k in apc[i].keys():
-                    if k not in pair_to_id:
-                        pair_to_id[k] = len(id_to_pair)
-                        id_to_pair.append(k)
-        if i == 0:
-            initial_cut = len(id_to_pair)
-
-    # compute the initial pair array
-    initial_pair_array = np.zeros((num_langs, initial_cut), np.float64)
-    for i, (lang, apc) in enumerate(P(pair_counts.items(), desc="building IPA")):
-        for pair, count in apc[0].items():
-            initial_pair_array[i, pair_to_id[pair]] = count
-
-    # compute the count deltas
-    def compute_count_deltas(all_pair_counts):
-        cumulative_pair_counts = {}
-        cumulative_pair_counts.update(all_pair_counts[0])
-        deltas = []
-        for pc in all_pair_counts[1:]:
-            deltas.append(
-                {
-                    pair: count - cumulative_pair_counts.get(pair, 0)
-                    for pair, count in pc.items()
-                }
-            )
-            cumulative_pair_counts.update(pc)
-        return deltas
-
-    delta_counts = {
-        lang: compute_count_deltas(apc[:num_merges])
-        for lang, apc in P(pair_counts.items(), desc="taking deltas")
-    }
-
-    # build the delta count array
-    delta_count_arrays = []
-    for i in P(range(num_merges - 1), desc="building DCA"):
-        stack = {}
-        for j, lang in enumerate(pair_counts):
-            if i < len(delta_counts[lang]):
-                for pair, dcount in delta_counts[lang][i].items():
-                    pid = pair_to_id[pair]
-                    if pid not in stack:
-                        stack[pid] = np.zeros(num_langs)
-                    stack[pid][j] = dcount
-        keys = np.array(list(stack.keys()), dtype=np.int64)
-        if stack:
-            values = np.hstack([stack[k][:, None] for k in keys])
-        else:
-            values = np.zeros((num_langs, 0))
-        delta_count_arrays.append((keys, values))
-
-    # transpose the pair counts
-    pair_counts2 = {}
-    for lang, apc in P(pair_counts.items(), desc="building PC2"):
-        for i, pc in enumerate(apc[:num_merges]):
-            for pair, count in pc.items():
-                key = lang, pair_to_id[pair]
-                pair_counts2.setdefault(key, [])
-                pair_counts2[key].append((i, count))
+    if pre is None:
+        pre = precompute(pair_counts, num_merges, verbose=verbose)
+    pair_to_id, id_to_pair = pre.pair_to_id, pre.id_to_pair
+    count_index = pre.count_index
 
     # initialize the model
     if verbose:
         print("model init")
 
-    with gp.Env(empty=True) as env:
-        if not verbose or True:
-            env.setParam("OutputFlag", 0)
-        # env.setParam("LPWarmStart", 2)
-        env.start()
-        m = gp.Model("tokenizer_attack", env=env)
-
-    # lang_v = m.addMVar((num_langs,), 0, 1, name="lang_v")
-    lang_v = [m.addVar(0, 1, name=name) for name in langs]
-    # m.addConstr(lang_v.sum() == 1)
-    m.addConstr(sum(lang_v) == 1)
-    # viol_v = m.addMVar((num_merges,), 0, name="viol_v")
-    viol_v = [m.addVar(lb=0, name=f"viol{i}") for i in range(num_merges)]
+    # solver output is noisy with many small re-solves, so it stays off even when verbose
+    lp = make_backend(backend, verbose=False)
+
+    lang_v = lp.add_vars(num_langs, 0, 1, names=langs)
+    simplex_row = lp.add_rows(np.ones((1, num_langs)), lang_v, "=", np.ones(1))
+    viol_v = lp.add_vars(num_merges, 0, names=[f"viol{i}" for i in range(num_merges)])
     lang_vals = np.ones(len(pair_counts)) / len(pair_counts)
     viol_vals = [0 for _ in range(len(viol_v))]
     pair_viol_v, pair_viol_vals = {}, {}
     # pair_viol_v = m.addVars(range(len(id_to_pair)))
     # pair_viol_vals = {v: 0 for v in pair_viol_v}
     denoms = np.array([lang_denoms[lang] for lang in langs])
-    primal_tol = m.getParamInfo("FeasibilityTol")[2]
+    primal_tol = lp.primal_tol
+
+    # merges that never occur as a pair can't be constrained (the first pair is skipped as well)
+    mids = pre.merge_ids(merge_subset)
+    missing_merges = {merge for merge, mid in zip(merge_subset, mids) if mid is None}
+    all_mids = mids
+    if merge_steps is not None:
+        selected = set(merge_steps)
+        mids = [mid if i in selected else None for i, mid in enumerate(mids)]
+    scanner = make_scanner(
+        pre,
+        mids,
+        workers=workers,
+        snapshot_interval=snapshot_interval,
+        debug=debug,
+        progress=P,
+    )
+
+    scheduler = make_schedule(schedule, competitor_batch_size, max_add)
+
+    # constraint blocks in the order they were added, enough to rebuild the model
+    blocks = []
+    # (merge, competitor) -> (row id, block index), and solves the row has been non-binding for
+    rows, idle = {}, {}
+    # rows that were pruned before, they stay once separation adds them back
+    pruned = set()
+
+    def add_constraints(i, mid, cands, counts):
+        """
+        Add the rows requiring merge i's pair mid to beat every pair in cands, where counts
+        holds the normalized counts of [mid] + cands at merge i.
+        """
+        new_variables = []
+        for cand in cands:
+            if cand not in pair_viol_v:
+                pair_viol_v[cand] = lp.add_var(lb=0, name=f"pviol{i}")
+                new_variables.append(cand)
+            all_constraints.add((i, cand))
+
+        n = len(cands)
+        A = np.hstack([counts[:1] - counts[1:], np.ones((n, 1)), np.eye(n)])
+        x = lang_v + [viol_v[i]] + [pair_viol_v[cand] for cand in cands]
+        ids = lp.add_rows(A, x, ">=", np.zeros(n))
+        for cand, row in zip(cands, ids):
+            rows[(i, cand)], idle[(i, cand)] = (row, len(blocks)), 0
+        blocks.append((i, mid, list(cands)))
+        return new_variables
+
+    def prune():
+        """
+        Remove the constraints that have been non-binding for prune_after solves in a row. They
+        leave all_constraints too, so separation adds them back if they are violated again. A
+        constraint is only pruned once, otherwise the same rows can be pruned and added back
+        forever.
+        """
+        keys = list(rows)
+        ids = [rows[key][0] for key in keys]
+        if not ids:
+            return 0
+        binding = (lp.slacks(ids) <= primal_tol) | (np.abs(lp.duals(ids)) > primal_tol)
+        stale = []
+        for key, is_binding in zip(keys, binding.tolist()):
+            idle[key] = 0 if is_binding else idle[key] + 1
+            if idle[key] >= prune_after and key not in pruned:
+                stale.append(key)
+        if stale:
+            lp.remove_rows([rows[key][0] for key in stale])
+            for key in stale:
+                _, block = rows.pop(key)
+                del idle[key]
+                all_constraints.discard(key)
+                pruned.add(key)
+                blocks[block][2].remove(key[1])
+        return len(stale)
+
+    def live_blocks():
+        return [block for block in blocks if block[2]]
+
+    # duals of the last solve, by (merge, competitor)
+    row_duals = {}
+
+    def solve_lp():
+        """
+        Solve and return the new solution and the time it took, or None if the deadline passed
+        before the LP was solved.
+        """
+        lp.set_objective(list(pair_viol_v.values()) + viol_v)
+        solver_start = time.perf_counter()
+        time_limit = None if deadline is None else max(deadline - reserve - solver_start, 0)
+        if not lp.optimize(time_limit):
+            return None
+        if duals:
+            # pruning changes the model, so they are read right after solving
+            keys = list(rows)
+            values = lp.duals(simplex_row + [rows[key][0] for key in keys]).tolist()
+            row_duals["simplex"] = values[0]
+            row_duals.update(zip(keys, values[1:]))
+        pair_viol_vals = dict(
+            zip(pair_viol_v.keys(), lp.values(list(pair_viol_v.values())).tolist())
+        )
+        return (
+            lp.values(lang_v),
+            lp.values(viol_v).tolist(),
+            pair_viol_vals,
+            time.perf_counter() - solver_start,
+        )
+
+    active_set = [None] * len(merge_subset)
+    all_constraints = set()
+    start_epoch, solver_time = 0, 0
+    objective = None
+    # whether lang_vals etc. are the solution of the LP as it stands, and if not, the
+    # constraints the solution doesn't know about yet
+    lp_solved, unsolved = True, set()
+
+    def solve_seeded():
+        nonlocal lang_vals, viol_vals, pair_viol_vals, solver_time, objective, lp_solved
+        solved = solve_lp()
+        lp_solved = solved is not None
+        if not lp_solved:
+            unsolved.update(all_constraints)
+        else:
+            lang_vals, viol_vals, pair_viol_vals, lp_time = solved
+            solver_time += lp_time
+            objective = lp.objective_value
+
+    # pair ids differ between precomputations, so checkpoints record which ones they use
+    pairs = None if checkpoint is None else pairs_digest(id_to_pair)
+    if resume and checkpoint is not None and checkpoint.exists():
+        state = load_checkpoint(checkpoint, langs, num_merges, denoms.tolist(), pairs)
+        for i, mid, cands in P(state["blocks"], desc="rebuilding model"):
+            if all_mids[i] != mid:
+                raise ValueError(f"{checkpoint}: merge {i} has a different pair, refusing to resume")
+            add_constraints(i, mid, cands, count_index.counts_at(i, [mid] + cands) / denoms)
+        lang_vals = np.array(state["lang_vals"])
+        viol_vals = state["viol_vals"]
+        # by pair, pruning leaves variables behind that the replay doesn't recreate
+        pair_viol_vals = {int(pair): value for pair, value in state["pair_viol_vals"].items()}
+        active_set, objective = state["active_set"], state["objective"]
+        pruned.update((i, cand) for i, cand in state["pruned"])
+        idle.update(zip(list(rows), state["idle"]))
+        start_epoch, solver_time = state["epoch"] + 1, state["solver_time"]
+        print(f"resumed from {checkpoint} at epoch {start_epoch}")
+        if not state.get("lp_solved", True):
+            # the run stopped while solving the LP with the last constraints
+            solve_seeded()
+    else:
+        if resume:
+            print(f"no checkpoint at {checkpoint}, starting from scratch")
+        seed = list(seed or [])
+        if warm_start:
+            approx_vals, approx_blocks, approx_stats = approximate_mixture(
+                pre, mids, denoms, competitor_batch_size=competitor_batch_size, progress=P
+            )
+            seed += approx_blocks
+            print(f"approximate warm start: {approx_stats}")
+        for i, mid, cands in P(seed, desc="seeding model"):
+            # pairs without records in these categories can't be constrained
+            cands = [
+                cand
+                for cand in cands
+                if id_to_pair[cand] in pair_to_id and (i, cand) not in all_constraints
+            ]
+            if i < num_merges and mids[i] == mid and cands:
+                add_constraints(i, mid, cands, count_index.counts_at(i, [mid] + cands) / denoms)
+        if warm_start:
+            # the first separation runs at the approximate mixture, the LP follows after it.
+            # The scan skips the seeded rows, so it can't tell whether the mixture meets them
+            lang_vals = approx_vals
+            lp_solved = not blocks
+            unsolved.update(all_constraints)
+        elif blocks:
+            solve_seeded()
+        if blocks:
+            print(f"seeded with {len(blocks)} constraint blocks")
 
     if verbose:
         print("do optimization")
+    # one JSON line of statistics per epoch
+    profile_file = None if profile is None else open(profile, "a" if resume else "w")
+
+    def log_epoch(**record):
+        if profile_file is not None:
+            record["lp_vars"], record["lp_rows"] = lp.num_vars, lp.num_rows
+            # ru_maxrss is in KB on Linux
+            record["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            profile_file.write(json.dumps(record) + "\n")
+            profile_file.flush()
+
+    def separate(mix, pviol, viol_vals):
+        """
+        Scan at the given mixture, returning the full scan and the constraints to add. A scan
+        cut off by the deadline is incomplete, and only good for being thrown away.
+        """
+        full_scan = scanner.scan(
+            mix,
+            pviol,
+            viol_vals,
+            all_constraints,
+            scheduler.competitor_batch_size,
+            np.inf if scheduler.ranked else scheduler.max_add,
+            primal_tol,
+            cancelled=expired,
+        )
+        if scheduler.ranked:
+            return full_scan, full_scan.most_violated(scheduler.max_add)
+        return full_scan, full_scan
+
+    # scans run in this thread while the LP solves, the solvers release the GIL
+    pipeline_pool = ThreadPoolExecutor(1) if pipeline else None
+    speculated = None
+
     # do the optimization
-    active_set = [None] * len(merge_subset)
-    all_constraints, missing_merges = set(), set()
-
-    start_time, solver_time = time.perf_counter(), 0
-    for epoch in range(max_iters):
-        # initialize the priority queue
-        mix = lang_vals / denoms
-        prios = mix @ initial_pair_array
-        prios.resize(len(id_to_pair))
-        for pair, pviol in pair_viol_vals.items():
-            prios[pair] -= max(0, pviol)
-
-        pq = PriorityQueue.from_numpy(prios)
-        priohist = [prios.copy()]
-
-        def pop():
-            while True:
-                item = pq.pop()
-                # cursed float equality test
-                if prios[item.value] == item.priority:
-                    return item
-                elif debug:
-                    assert (
-                        prios[item.value] < item.priority
-                    ), f"{prios[item.value]}, {item.priority}"
-
-        def get_cur_count(i, lang, pair):
-            transcript = pair_counts2.get((lang, pair), [])
-            if not transcript:
-                return 0
-            idx = bisect.bisect_right(transcript, (i, 2 << 62))
-            if idx == 0:
-                return 0
-            return transcript[idx - 1][1]
+    start_time, separation_time = time.perf_counter(), 0
+    lp_size, schedule_log = [], []
+
+    def scan_inputs():
+        pviol = np.zeros(len(id_to_pair))
+        for pair, pviol_val in pair_viol_vals.items():
+            pviol[pair] = max(0, pviol_val)
+        return lang_vals / denoms, pviol
+
+    def save_state(epoch):
+        save_checkpoint(
+            checkpoint,
+            dict(
+                langs=langs,
+                num_merges=num_merges,
+                denoms=denoms.tolist(),
+                pairs=pairs,
+                epoch=epoch,
+                solver_time=solver_time,
+                blocks=live_blocks(),
+                lang_vals=lang_vals.tolist(),
+                viol_vals=viol_vals,
+                pair_viol_vals=pair_viol_vals,
+                active_set=active_set,
+                objective=objective,
+                lp_solved=lp_solved,
+                pruned=sorted(pruned),
+                # in the order the replay recreates the rows
+                idle=[idle[i, cand] for i, _, cands in live_blocks() for cand in cands],
+            ),
+        )
+
+    def out_of_time(epoch):
+        print("time budget exhausted -- stopping")
+        if checkpoint is not None:
+            # the run can be continued with resume
+            save_state(epoch)
+        return "time_budget"
+
+    status = "max_iters"
+    for epoch in range(start_epoch, max_iters):
+        if expired():
+            status = out_of_time(epoch - 1)
+            break
+        mix, pviol = scan_inputs()
+
+        separation_start = time.perf_counter()
+        scan = None
+        if speculated is not None:
+            full_scan = scan = revalidate(
+                speculated, count_index, mix, pviol, viol_vals, all_constraints, primal_tol
+            )
+            speculated = None
+            if not scan.found:
+                scan = None
+        speculative = scan is not None
+        if not speculative:
+            full_scan, scan = separate(mix, pviol, viol_vals)
+        if expired():
+            # the scan may have been cut off, nothing it found is added
+            status = out_of_time(epoch - 1)
+            break
+        epoch_stats = dict(
+            epoch=epoch,
+            **scheduler.state(),
+            separation_time=time.perf_counter() - separation_start,
+            pops=scan.pops,
+            # the tournament tree is updated in place, so no pop is ever stale
+            stale_pops=0,
+            candidates=scan.candidates,
+            exit_merge=scan.exit_merge,
+            speculative=speculative,
+        )
+        separation_time += epoch_stats["separation_time"]
+        if deadline is not None and not speculative:
+            # the diagnostics scan takes about as long per merge as a separation scan
+            per_merge = epoch_stats["separation_time"] / max(scan.exit_merge + 1, 1)
+            reserve = min(
+                max(reserve, per_merge * len(all_mids)),
+                DIAGNOSTICS_SHARE * (deadline - run_start),
+            )
+        build_start = time.perf_counter()
+        for i, active in scan.active.items():
+            active_set[i] = active
 
         new_constraints, new_variables = set(), set()
-        for i, (merge, viol) in enumerate(zip(P(merge_subset), viol_vals)):
-            if merge not in pair_to_id or np.isclose(pair_to_id[merge], 0):
-                missing_merges.add(merge)
-                # print(f"Warn: could not find merge '{merge}'")
-            else:
-                mid = pair_to_id[merge]
-                # we want the prio without the pair violation
-                mprio = prios[mid] + max(0, pair_viol_vals.get(mid, 0))
-                popped = []
-                active_set[i] = []
-                cutoff = mprio + max(0, viol) + primal_tol
-                candidates = set()
-
-                while len(candidates) < competitor_batch_size:
-                    item = pop()
-                    tid, tprio = item.value, item.priority
-                    popped.append(item)
-                    active_set[i].append((item.value, item.priority))
-                    if tprio > cutoff:
-                        assert tid != mid, f"{tprio} {pair_viol_vals.get(item, 0)}"
-                        if (i, tid) not in all_constraints:
-                            candidates.add(tid)
-                    else:
-                        break
-                    # assert not tprio < cutoff, f"{[p.value for p in popped]}, {mid=}, {mprio=}, {tprio=}, {viol=}, {cutoff=}"
-
-                for item in popped:
-                    pq.push(item)
-
-                candidates.add(mid)
-
-                cand_counts = {
-                    cand: np.array(
-                        [get_cur_count(i, lang, cand) / lang_denoms[lang] for lang in langs]
-                    )
-                    for cand in candidates
-                }
-
-                if debug:
-                    for pair, coeffs in cand_counts.items():
-                        pviol = max(0, pair_viol_vals.get(pair, 0))
-                        count_val = lang_vals @ coeffs - pviol
-                        prio_val = prios[pair]
-                        assert np.isclose(
-                            count_val, prio_val
-                        ), f"{i}, {pair}, {count_val}, {prio_val}, {pviol}"
-
-                A = []
-                for cand in candidates:
-                    if cand == mid:
-                        continue
-                    if cand not in pair_viol_v:
-                        pair_viol_v[cand] = m.addVar(lb=0, name=f"pviol{i}")
-                        new_variables.add(cand)
-
-                    A.append(cand_counts[mid] - cand_counts[cand])
-
-                    new_constraints.add((i, cand))
-                    all_constraints.add((i, cand))
-
-                if A:
-                    n = len(cand_counts) - 1
-                    A = np.hstack([np.vstack(A), np.ones((n, 1)), np.eye(n)])
-                    x = (
-                        lang_v
-                        + [viol_v[i]]
-                        + [pair_viol_v[cand] for cand in candidates if cand != mid]
-                    )
-                    b = np.zeros(n)
-                    m.addMConstr(A, x, ">=", b)
-
-            if i != num_merges - 1:
-                items, dcounts = delta_count_arrays[i]
-                mixdcounts = mix @ dcounts
-
-                if debug:
-                    for idx, mdc in zip(items, mixdcounts):
-                        assert (
-                            mdc <= 1e-7 or prios[idx] <= 1e-7
-                        ), f"{idx=}, {mdc=}, {prios[idx]=}"
-
-                prios[items] += mixdcounts
-                pq.push_batch(items, prios[items])
-                priohist.append((items, mixdcounts))
-
-            if len(new_constraints) >= max_add:
-                break
+        for i, mid, competitors, cand_prios in scan.found:
+            candidates = set(competitors)
+            candidates.add(mid)
+            cands = [cand for cand in candidates if cand != mid]
+            cand_counts = count_index.counts_at(i, [mid] + cands) / denoms
+
+            if debug:
+                for pair, coeffs in zip([mid] + cands, cand_counts):
+                    count_val = lang_vals @ coeffs - pviol[pair]
+                    prio_val = cand_prios[pair]
+                    assert np.isclose(
+                        count_val, prio_val
+                    ), f"{i}, {pair}, {count_val}, {prio_val}, {pviol[pair]}"
+
+            new_variables.update(add_constraints(i, mid, cands, cand_counts))
+            new_constraints.update((i, cand) for cand in cands)
+
+        epoch_stats.update(
+            build_time=time.perf_counter() - build_start,
+            constraints_added=len(new_constraints),
+            variables_added=len(new_variables),
+        )
 
+        i = scan.exit_merge
         print(f"exited at merge {i}")
-        if len(new_constraints) == 0:
+        if len(new_constraints) == 0 and lp_solved:
             print("added no constraints -- exiting")
+            log_epoch(**epoch_stats, lp_time=0.0)
+            status = "converged"
             break
+        elif len(new_constraints) == 0:
+            print("added no constraints, solving the LP before checking again")
         elif len(new_constraints) > 10:
             print(f"added {len(new_constraints)} new constraints")
         else:
@@ -270,59 +472,198 @@ def lazy_optimize(
             new_vars_lookup = {id_to_pair[v] for v in new_variables}
             print(f"added variables {new_vars_lookup}")
 
-        m.setObjective(
-            gp.quicksum(pair_viol_v.values()) + gp.quicksum(viol_v), GRB.MINIMIZE
-        )
-        solver_start = time.perf_counter()
-        m.optimize()
-        solver_time += time.perf_counter() - solver_start
-
-        lang_vals = np.array([lv.X for lv in lang_v])
-        viol_vals = [v.X for v in viol_v]
-        pair_viol_vals = {k: v.X for k, v in pair_viol_v.items()}
-        print(f"loss: {m.ObjVal} ({sum(viol_vals)}, {sum(pair_viol_vals.values())})")
+        if pipeline:
+            # the scan only reads all_constraints, which stays unchanged until it is collected
+            pending = pipeline_pool.submit(separate, mix, pviol, viol_vals)
+        solved = solve_lp()
+        if pipeline:
+            speculated = pending.result()[1]
+        if solved is None:
+            # the new rows stay in the checkpoint, a resumed run solves the LP first
+            lp_solved = False
+            unsolved.update(new_constraints)
+            status = out_of_time(epoch)
+            break
+        lang_vals, viol_vals, pair_viol_vals, lp_time = solved
+        lp_solved = True
+        unsolved.clear()
+        solver_time += lp_time
+        schedule_log.append(scheduler.state())
+        scheduler.update(full_scan, epoch_stats["separation_time"], lp_time)
+        if scheduler.ranked:
+            print(f"next epoch: {scheduler.state()}")
+        # read before pruning, changing the model discards the solution
+        objective = lp.objective_value
+        if prune_after:
+            epoch_stats["constraints_pruned"] = prune()
+            if epoch_stats["constraints_pruned"]:
+                print(f"pruned {epoch_stats['constraints_pruned']} non-binding constraints")
+        lp_size.append(dict(epoch=epoch, rows=lp.num_rows, vars=lp.num_vars))
+        print(f"loss: {objective} ({sum(viol_vals)}, {sum(pair_viol_vals.values())})")
+        log_epoch(**epoch_stats, lp_time=lp_time, objective=objective)
         print(
             dict(sorted(zip(langs, lang_vals), key=lambda langfreq: -langfreq[1])[:10])
         )
 
-    return dict(
+        if intermediate is not None:
+            write_json_atomic(
+                intermediate,
+                dict(
+                    epoch=epoch,
+                    objective=objective,
+                    elapsed=time.perf_counter() - start_time,
+                    lang_vals=dict(zip(langs, lang_vals.tolist())),
+                ),
+            )
+        if checkpoint is not None and checkpoint_every and (epoch + 1) % checkpoint_every == 0:
+            save_state(epoch)
+
+    # the diagnostics scan below is not part of the optimization
+    opt_time = time.perf_counter() - start_time
+    checked = sum(mid is not None for mid in all_mids)
+    violated = unchecked = 0
+    if status != "converged" or merge_steps is not None:
+        scanned = 0
+        if not expired(final=True):
+            # one competitor per merge is enough to tell whether it is violated
+            mix, pviol = scan_inputs()
+            full_scanner = scanner if merge_steps is None else Scanner(pre, all_mids)
+            full_scan = full_scanner.scan(
+                mix,
+                pviol,
+                viol_vals,
+                all_constraints - unsolved,
+                1,
+                np.inf,
+                primal_tol,
+                cancelled=lambda: expired(final=True),
+            )
+            violated, scanned = full_scan.num_found, full_scan.exit_merge + 1
+        # the merges after the ones the scan got to before the deadline
+        unchecked = sum(mid is not None for mid in all_mids[scanned:])
+    diagnostics = dict(
+        status=status,
+        objective=objective,
+        verified_merges=checked - violated - unchecked,
+        violated_merges=violated,
+        unchecked_merges=unchecked,
+    )
+    print(f"diagnostics: {diagnostics}")
+    scanner.close()
+    if pipeline_pool is not None:
+        pipeline_pool.shutdown()
+    if profile_file is not None:
+        profile_file.close()
+
+    solution = dict(
         lang_vals=dict(zip(langs, lang_vals.tolist())),
         viol_vals=viol_vals,
         pair_viol_vals=pair_viol_vals,
         missing_merges=missing_merges,
         active_set=active_set,
-        timing=dict(solver_time=solver_time, opt_time=time.perf_counter() - start_time),
+        blocks=live_blocks(),
+        diagnostics=diagnostics,
+        lp_size=lp_size,
+        schedule=schedule_log,
+        timing=dict(
+            solver_time=solver_time,
+            separation_time=separation_time,
+            opt_time=opt_time,
+            precompute=pre.timing,
+        ),
+        memory=pre.memory_report(),
     )
+    if duals:
+        solution["duals"] = dict(
+            simplex=row_duals.get("simplex", 0.0),
+            blocks=[
+                [row_duals.get((i, cand), 0.0) for cand in cands]
+                for i, _, cands in solution["blocks"]
+            ],
+        )
+    return solution
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(prog="TokenizerInference")
-    parser.add_argument("data_root")
-    parser.add_argument(
-        "--merges", type=int, help="Number of merges to consider", default=30000
-    )
-    parser.add_argument(
-        "--denom", type=str, help="Which normalization to apply", default="pairs"
-    )
-    parser.add_argument(
-        "--variant", type=str, help="Which language subdir to run", default=None
-    )
-    parser.add_argument(
-        "--langlist", type=str, help="Which language list to run", default=None
-    )
-    args = parser.parse_args()
-    root = Path(args.data_root)
-    print(Path.cwd(), root)
-    assert Path.cwd().exists()
-    assert root.resolve().exists()
-    if not (root / "merges.txt").exists():
-        print("incomplete: no merges")
-        sys.exit()
+def column_generation(merges, pair_counts, lang_denoms, columns=10, columns_per_round=10, **kwargs):
+    """
+    lazy_optimize over a growing subset of the categories, starting from the columns categories
+    most frequent in the first merges and adding up to columns_per_round categories priced in
+    with the duals of every restricted solve (see colgen.py). pair_counts should be stores or
+    PairCountFiles, so that only the active categories are held in memory. Returns the solution
+    of the last restricted solve, with zero weight for the inactive categories. The time
+    budget covers all rounds, and no categories are added once it is used up.
+    """
+    num_merges, verbose = kwargs["num_merges"], kwargs.get("verbose", True)
+    time_budget, deadline = kwargs.pop("time_budget", None), kwargs.pop("deadline", None)
+    if time_budget is not None:
+        deadline = min(time.perf_counter() + time_budget, np.inf if deadline is None else deadline)
+
+    def expired():
+        return deadline is not None and time.perf_counter() > deadline
 
+    P = partial(tqdm.tqdm, dynamic_ncols=True) if verbose else lambda x, **_: x
+    langs = list(pair_counts.keys())
+    merge_subset = [str(merge) for merge in merges[:num_merges]]
+    active = initial_columns(pair_counts, merges, lang_denoms, columns)
+
+    rounds, rows = [], []
+    while True:
+        print(f"solving over {len(active)} of {len(langs)} categories")
+        subset = {lang: pair_counts[lang] for lang in active}
+        pre = precompute(subset, num_merges, verbose=verbose)
+        # carry the constraints over, pair ids differ between precomputations
+        pair_to_id, id_to_pair = pre.pair_to_id, pre.id_to_pair
+        seed = [
+            (i, pair_to_id[merge], [pair_to_id[cand] for cand in cands])
+            for i, merge, cands, _ in rows
+        ]
+        solution = lazy_optimize(
+            merges, subset, lang_denoms, pre=pre, seed=seed, duals=True, deadline=deadline, **kwargs
+        )
+        duals = solution.pop("duals")
+        rows = [
+            (i, id_to_pair[mid], [id_to_pair[cand] for cand in cands], block_duals)
+            for (i, mid, cands), block_duals in zip(solution["blocks"], duals["blocks"])
+        ]
+        missing = [(i, merge) for i, merge in enumerate(merge_subset) if merge not in pair_to_id]
+
+        prices = {}
+        for lang in P([lang for lang in langs if lang not in subset], desc="pricing"):
+            if expired():
+                break
+            prices[lang] = price_category(
+                pair_counts[lang], lang_denoms[lang], rows, duals["simplex"], missing, num_merges
+            )
+        # categories that contain missing merges first, then by reduced cost
+        improving = sorted(
+            (lang for lang, (cost, covered) in prices.items() if cost < -REDUCED_COST_TOL or covered),
+            key=lambda lang: (-prices[lang][1], prices[lang][0]),
+        )
+        # the next restricted solve would have no time left
+        added = [] if expired() else improving[:columns_per_round]
+        rounds.append(
+            dict(
+                categories=len(active),
+                objective=sum(solution["viol_vals"]) + sum(solution["pair_viol_vals"].values()),
+                min_reduced_cost=float(min((cost for cost, _ in prices.values()), default=0.0)),
+                added=added,
+            )
+        )
+        print(f"column generation: {rounds[-1]}")
+        if not added:
+            break
+        active += added
+
+    solution["lang_vals"] = {lang: solution["lang_vals"].get(lang, 0.0) for lang in langs}
+    solution["column_generation"] = rounds
+    return solution
+
+
+def category_dirs(root, variant=None):
     if (root / "meta.json").exists():
         with (root / "meta.json").open() as f:
             meta = json.load(f)
-            langs = meta["byte_count"].keys()
+            langs = list(meta["byte_count"].keys())
     else:
         langs = [subdir.name for subdir in root.iterdir()]
 
@@ -330,24 +671,77 @@ if __name__ == "__main__":
         subdir = root / lang
         if "." in subdir.name:
             continue
-        if args.variant is not None:
-            subdir = subdir / args.variant
-        if not (subdir / "all_pair_counts.json").exists():
-            print(f"incomplete: {lang}")
-            sys.exit()
+        if variant is not None:
+            subdir = subdir / variant
+        yield lang, subdir
+
+
+def find_incomplete(root, variant=None):
+    """
+    Return why the experiment at root can't be solved yet, or None if it can.
+    """
+    if not (root / "merges.txt").exists():
+        return "no merges"
+    for lang, subdir in category_dirs(root, variant):
+        if not has_pair_counts(subdir):
+            return lang
+    return None
+
 
-    merges, pair_counts, training_counts = load_data(root, verbose=True, subdir=args.variant, langlist=args.langlist)
+def solution_path(root, denom, merges, variant=None, langlist=None, prefix="solution"):
+    variant_str = "" if variant is None else f"_{variant}"
+    langlist_str = "" if langlist is None else f"_{langlist}"
+    return root / f"{prefix}_{denom}_{merges}{variant_str}{langlist_str}.json"
 
-    kwargs = dict(
-        verbose=True,
+
+def is_up_to_date(root, path, variant=None, langlist=None):
+    """
+    Whether the solution file at path is newer than every input it was computed from.
+    """
+    # a checkpoint next to the solution means its solve was cut short
+    if not path.exists() or checkpoint_path(path).exists():
+        return False
+    inputs = [root / "merges.txt", root / "meta.json"]
+    if langlist is not None:
+        inputs.append(root / f"{langlist}.txt")
+    for _, subdir in category_dirs(root, variant):
+        inputs += [subdir / "all_pair_counts.json", store_path(subdir) / "meta.json"]
+    newest = max(p.stat().st_mtime for p in inputs if p.exists())
+    return path.stat().st_mtime >= newest
+
+
+def solver_kwargs(args, verbose=True):
+    return dict(
+        verbose=verbose,
         num_merges=args.merges,
         competitor_batch_size=10,
         max_iters=10**10,
         max_add=100,
         debug=False,
+        backend=args.backend,
+        workers=args.workers,
+        snapshot_interval=args.snapshot_interval,
+        checkpoint_every=args.checkpoint_every,
+        warm_start=args.warm_start,
+        prune_after=args.prune_after,
+        schedule=args.schedule,
+        pipeline=args.pipeline,
+        time_budget=args.time_budget,
+        deadline=args.deadline,
     )
 
-    solution = lazy_optimize(merges, pair_counts, training_counts[args.denom], **kwargs)
+
+def with_deadline(args):
+    """
+    args with the deadline of --time_budget, which is shared by all solves from now on.
+    """
+    deadline = None if args.time_budget is None else time.perf_counter() + args.time_budget
+    return argparse.Namespace(**dict(vars(args), deadline=deadline))
+
+
+def format_solution(solution, kwargs, denom):
+    # the constraint blocks are only needed to seed further solves
+    solution.pop("blocks", None)
 
     # Sort the lang vals for convenience
     solution["lang_vals"] = dict(
@@ -357,13 +751,740 @@ if __name__ == "__main__":
     # Convert set to list for JSON
     solution["missing_merges"] = list(solution["missing_merges"])
 
-    # Dump the args into the output as well
-    solution['kwargs'] = kwargs
-    solution['kwargs']['denom'] = args.denom
-    
-    print(solution["lang_vals"])
+    # Dump the args into the output as well (the deadline only means something in this process)
+    solution['kwargs'] = {key: value for key, value in kwargs.items() if key != "deadline"}
+    solution['kwargs']['denom'] = denom
+    return solution
+
+
+def write_solution(path, solution, kwargs, denom):
+    with path.open("w") as f:
+        json.dump(format_solution(solution, kwargs, denom), f)
+
+
+def select_merge_steps(num_merges, stride=None, sample=None, seed=0):
+    """
+    Every stride-th merge step, or one random step from each of sample equally long strata.
+    """
+    if stride is not None:
+        return list(range(0, num_merges, stride))
+    bounds = np.linspace(0, num_merges, min(sample, num_merges) + 1).astype(np.int64)
+    rng = np.random.default_rng(seed)
+    return [int(rng.integers(lo, hi)) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+def solve_and_write(root, args, merges, pair_counts, training_counts, num_merges, verbose=True, **extra):
+    kwargs = solver_kwargs(args, verbose=verbose)
+    kwargs["num_merges"] = num_merges
+    prefix = "solution"
+    if args.merge_stride is not None or args.merge_sample is not None:
+        # a subsampled solve is only an estimate of the full one, keep the two apart
+        prefix = "solution_sampled"
+        extra["merge_steps"] = select_merge_steps(num_merges, args.merge_stride, args.merge_sample)
+    path = solution_path(root, args.denom, num_merges, args.variant, args.langlist, prefix=prefix)
+    checkpoint = checkpoint_path(path)
+    profile = path.with_name("profile" + path.name[len("solution"):]).with_suffix(".jsonl")
+    intermediate = path.with_name("partial" + path.name[len("solution"):])
+    solution = lazy_optimize(
+        merges,
+        pair_counts,
+        training_counts[args.denom],
+        checkpoint=checkpoint,
+        resume=args.resume,
+        profile=profile if args.profile else None,
+        intermediate=intermediate,
+        **extra,
+        **kwargs,
+    )
+    blocks = solution["blocks"]
+    if "merge_steps" in extra:
+        kwargs.update(merge_stride=args.merge_stride, merge_sample=args.merge_sample)
+    write_solution(path, solution, kwargs, args.denom)
+    # the solution supersedes the intermediate one, and the checkpoint unless it was cut short
+    intermediate.unlink(missing_ok=True)
+    if solution["diagnostics"]["status"] == "converged":
+        checkpoint.unlink(missing_ok=True)
+    return solution, blocks
+
+
+def load_precomputed(root, args, num_merges, langlist=None, verbose=True):
+    """
+    load_data and precompute, going through the experiment's precomputation cache with --cache.
+    The pair counts are streamed then, so a cache hit only parses their first step. With
+    --prune_pairs, pairs that can never beat the merge are dropped afterwards.
+    """
+    merges, pair_counts, training_counts = load_data(
+        root,
+        verbose=verbose,
+        subdir=args.variant,
+        langlist=langlist,
+        stream=args.stream or args.cache,
+    )
+    if args.cache:
+        pre = cached_precompute(root, pair_counts, num_merges, args.variant, verbose=verbose)
+    else:
+        pre = precompute(pair_counts, num_merges, verbose=verbose)
+    if args.prune_pairs:
+        pre = prune_dominated(pre, merges, num_merges, verbose=verbose)
+    return merges, pair_counts, training_counts, pre
+
+
+def approx_experiment(root, args, verbose=True):
+    merges, pair_counts, training_counts, pre = load_precomputed(
+        root, args, args.merges, args.langlist, verbose=verbose
+    )
+    solution = approx_optimize(
+        merges,
+        pair_counts,
+        training_counts[args.denom],
+        num_merges=args.merges,
+        verbose=verbose,
+        pre=pre,
+    )
+    path = solution_path(
+        root, args.denom, args.merges, args.variant, args.langlist, prefix="solution_approx"
+    )
+    write_solution(path, solution, dict(num_merges=args.merges, approx=True), args.denom)
+    return solution
+
+
+def solve_experiment(root, args, verbose=True):
+    merges, pair_counts, training_counts, pre = load_precomputed(
+        root, args, args.merges, args.langlist, verbose=verbose
+    )
+    solution, _ = solve_and_write(
+        root, args, merges, pair_counts, training_counts, args.merges, verbose=verbose, pre=pre
+    )
+    sampled = args.merge_stride is not None or args.merge_sample is not None
+    if sampled and args.compare_full:
+        print("solving over all merges for comparison")
+        full_args = argparse.Namespace(**dict(vars(args), merge_stride=None, merge_sample=None))
+        full, _ = solve_and_write(
+            root,
+            full_args,
+            merges,
+            pair_counts,
+            training_counts,
+            args.merges,
+            verbose=verbose,
+            pre=pre,
+        )
+        if full["diagnostics"]["status"] == "time_budget":
+            print("the full solve ran out of time, not comparing")
+        else:
+            compare_sampled(root, args, solution, full)
+    return solution
+
+
+def compare_sampled(root, args, sampled, full):
+    """
+    Report how far a subsampled solve is from the full one, and add it to its solution file.
+    """
+    langs = list(full["lang_vals"])
+    diff = np.array([sampled["lang_vals"][lang] - full["lang_vals"][lang] for lang in langs])
+    sampled_time = sampled["timing"]["opt_time"]
+    full_time = full["timing"]["opt_time"]
+    comparison = dict(
+        max_abs_diff=float(np.abs(diff).max()),
+        l1_diff=float(np.abs(diff).sum()),
+        objective=sampled["diagnostics"]["objective"],
+        full_objective=full["diagnostics"]["objective"],
+        opt_time=sampled_time,
+        full_opt_time=full_time,
+        speedup=full_time / max(sampled_time, 1e-9),
+    )
+    print(f"comparison with the full solve: {comparison}")
+    path = solution_path(
+        root, args.denom, args.merges, args.variant, args.langlist, prefix="solution_sampled"
+    )
+    with path.open() as f:
+        solution = json.load(f)
+    solution["comparison"] = comparison
+    write_json_atomic(path, solution)
+
 
-    variant_str = "" if args.variant is None else f"_{args.variant}"
-    langlist_str = "" if args.langlist is None else f"_{args.langlist}"
-    with (root / f"solution_{args.denom}_{args.merges}{variant_str}{langlist_str}.json").open("w") as f:
+def solve_remote(root, args, url):
+    """
+    Have a solver_service.py instance solve the experiment and write its solution locally.
+    """
+    params = dict(
+        data_root=str(root.resolve()),
+        merges=args.merges,
+        denom=args.denom,
+        variant=args.variant,
+        langlist=args.langlist,
+        backend=args.backend,
+        schedule=args.schedule,
+        prune_after=args.prune_after,
+        warm_start=args.warm_start,
+        pipeline=args.pipeline,
+        time_budget=args.time_budget,
+    )
+    request = urllib.request.Request(
+        url.rstrip("/") + "/solve",
+        data=json.dumps(params).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            solution = json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(f"solver service failed:\n{json.loads(e.read())['error']}") from None
+    path = solution_path(root, args.denom, args.merges, args.variant, args.langlist)
+    with path.open("w") as f:
         json.dump(solution, f)
+    return solution
+
+
+def solve_langlists(root, args, verbose=True):
+    """
+    Solve every language list of the sweep, loading and precomputing once for all categories.
+    Each solve is seeded with the constraints found for the previous list.
+    """
+    merges, pair_counts, training_counts, pre = load_precomputed(
+        root, args, args.merges, verbose=verbose
+    )
+    all_langs = list(pair_counts.keys())
+
+    solutions, blocks = {}, []
+    for langlist in args.langlist_sweep:
+        langs = [item.name for item in load_langlist(root, langlist)]
+        langs = [lang for lang in langs if lang in pair_counts]
+        print(f"solving {langlist} ({len(langs)} categories)")
+        solutions[langlist], blocks = solve_and_write(
+            root,
+            # solution file names follow --langlist
+            argparse.Namespace(**dict(vars(args), langlist=langlist)),
+            merges,
+            {lang: pair_counts[lang] for lang in langs},
+            training_counts,
+            args.merges,
+            verbose=verbose,
+            pre=pre.select_langs([all_langs.index(lang) for lang in langs]),
+            seed=blocks,
+        )
+    return solutions
+
+
+def load_groups(path, langs):
+    """
+    Category groups from a JSON file mapping group names to lists of categories. Categories
+    missing from the file form a group of their own, and categories not in this experiment
+    are ignored.
+    """
+    with open(path) as f:
+        groups = {
+            name: [lang for lang in members if lang in langs]
+            for name, members in json.load(f).items()
+        }
+    groups = {name: members for name, members in groups.items() if members}
+    grouped = Counter(lang for members in groups.values() for lang in members)
+    if any(count > 1 for count in grouped.values()):
+        raise ValueError(f"{path}: categories in more than one group")
+    for name, members in groups.items():
+        if name in langs and members != [name]:
+            raise ValueError(f"{path}: group {name} is named like a category")
+    groups.update((lang, [lang]) for lang in langs if lang not in grouped)
+    return groups
+
+
+def solve_grouped(root, args, verbose=True):
+    """
+    Solve coarse to fine: first over the groups of args.groups, with every group's counts and
+    denominators summed, then with the groups that got more than args.group_threshold weight
+    split into their categories, seeded with the constraints of the coarse solve. Groups that
+    stay merged share their weight in proportion to their members' denominators. The answer is
+    only approximate, so it is written to solution_grouped_[options].json, next to and not over
+    an exact solve.
+    """
+    merges, pair_counts, training_counts, pre = load_precomputed(
+        root, args, args.merges, args.langlist, verbose=verbose
+    )
+    langs = list(pair_counts.keys())
+    lang_denoms = training_counts[args.denom]
+    kwargs = solver_kwargs(args, verbose=verbose)
+    path = solution_path(
+        root, args.denom, args.merges, args.variant, args.langlist, prefix="solution_grouped"
+    )
+    # holds the weights of the columns (groups or categories) of the solve that is running
+    intermediate = path.with_name("partial" + path.name[len("solution"):])
+
+    def solve_columns(columns, **extra):
+        # lazy_optimize only takes the column names from pair_counts when pre is given
+        denoms = {
+            name: sum(lang_denoms[lang] for lang in members) for name, members in columns.items()
+        }
+        combined = pre.combine_langs(
+            [[langs.index(lang) for lang in members] for members in columns.values()]
+        )
+        solution = lazy_optimize(
+            merges, columns, denoms, pre=combined, intermediate=intermediate, **extra, **kwargs
+        )
+        return solution, denoms
+
+    groups = load_groups(args.groups, langs)
+    print(f"coarse solve over {len(groups)} groups")
+    coarse, coarse_denoms = solve_columns(groups)
+    if coarse["diagnostics"]["status"] == "time_budget":
+        # the groups share the coarse weights, a refined solve would have no time left
+        print("time budget exhausted in the coarse solve, not refining")
+        refined, columns, solution, denoms = [], groups, dict(coarse), coarse_denoms
+    else:
+        refined = [
+            name for name, weight in coarse["lang_vals"].items() if weight > args.group_threshold
+        ]
+        columns = {}
+        for name, members in groups.items():
+            if name in refined:
+                columns.update((lang, [lang]) for lang in members)
+            else:
+                columns[name] = members
+        print(f"refining {len(refined)} groups ({len(columns)} variables)")
+        solution, denoms = solve_columns(columns, seed=coarse["blocks"])
+
+    solution["lang_vals"] = {
+        lang: solution["lang_vals"][name] * lang_denoms[lang] / denoms[name]
+        for name, members in columns.items()
+        for lang in members
+    }
+    solution["groups"] = dict(
+        coarse=coarse["lang_vals"], refined=refined, coarse_timing=coarse["timing"]
+    )
+    kwargs.update(groups=args.groups, group_threshold=args.group_threshold)
+    write_solution(path, solution, kwargs, args.denom)
+    intermediate.unlink(missing_ok=True)
+    return solution
+
+
+def solve_column_generation(root, args, verbose=True):
+    # streamed, so that categories are only parsed once they are priced or activated
+    merges, pair_counts, training_counts = load_data(
+        root, verbose=verbose, subdir=args.variant, langlist=args.langlist, stream=True
+    )
+    kwargs = solver_kwargs(args, verbose=verbose)
+    path = solution_path(root, args.denom, args.merges, args.variant, args.langlist)
+    # holds the weights of the active categories in the restricted solve that is running
+    intermediate = path.with_name("partial" + path.name[len("solution"):])
+    solution = column_generation(
+        merges,
+        pair_counts,
+        training_counts[args.denom],
+        columns=args.columns,
+        columns_per_round=args.columns_per_round,
+        intermediate=intermediate,
+        **kwargs,
+    )
+    kwargs.update(columns=args.columns, columns_per_round=args.columns_per_round)
+    write_solution(path, solution, kwargs, args.denom)
+    intermediate.unlink(missing_ok=True)
+    return solution
+
+
+# loaded data shared with the forked denominator solvers
+_shared = None
+
+
+def _solve_denom(denom):
+    root, args, merges, pair_counts, training_counts, pre = _shared
+    args = argparse.Namespace(**dict(vars(args), denom=denom))
+    path = solution_path(root, denom, args.merges, args.variant, args.langlist)
+    with path.with_suffix(".log").open("w") as log, redirect_stdout(log):
+        solution, _ = solve_and_write(
+            root, args, merges, pair_counts, training_counts, args.merges, verbose=False, pre=pre
+        )
+    return denom, solution
+
+
+def solve_denoms(root, args, verbose=True):
+    """
+    Solve for every denominator in args.denoms, loading and precomputing once. With more than
+    one job the solves run in forked processes that share the precomputation copy-on-write.
+    """
+    global _shared
+    merges, pair_counts, training_counts, pre = load_precomputed(
+        root, args, args.merges, args.langlist, verbose=verbose
+    )
+    missing = [denom for denom in args.denoms if denom not in training_counts]
+    if missing:
+        raise ValueError(f"no training counts for {missing}, available: {list(training_counts)}")
+
+    if args.jobs <= 1:
+        solutions = {}
+        for denom in args.denoms:
+            print(f"solving with denominator {denom}")
+            solutions[denom], _ = solve_and_write(
+                root,
+                argparse.Namespace(**dict(vars(args), denom=denom)),
+                merges,
+                pair_counts,
+                training_counts,
+                args.merges,
+                verbose=verbose,
+                pre=pre,
+            )
+        return solutions
+
+    _shared = (root, args, merges, pair_counts, training_counts, pre)
+    with mp.get_context("fork").Pool(min(args.jobs, len(args.denoms))) as pool:
+        return dict(pool.imap_unordered(_solve_denom, args.denoms))
+
+
+def solve_ladder(root, args, verbose=True):
+    """
+    Solve every merge prefix of the ladder, precomputing once for the longest one. Each solve
+    is seeded with the constraints found for the previous, shorter prefix.
+    """
+    ladder = sorted(set(args.merges_ladder))
+    merges, pair_counts, training_counts, pre = load_precomputed(
+        root, args, ladder[-1], args.langlist, verbose=verbose
+    )
+
+    solutions, blocks = {}, []
+    for num_merges in ladder:
+        print(f"solving the first {num_merges} merges")
+        solutions[num_merges], blocks = solve_and_write(
+            root,
+            args,
+            merges,
+            pair_counts,
+            training_counts,
+            num_merges,
+            verbose=verbose,
+            pre=pre,
+            seed=blocks,
+        )
+    return solutions
+
+
+def limit_memory(budget_gb):
+    if budget_gb is not None:
+        limit = int(budget_gb * 2**30)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def batch_solve(root, args):
+    """
+    Solve one experiment of a batch, logging its output next to the solution file.
+    """
+    path = solution_path(root, args.denom, args.merges, args.variant, args.langlist)
+    start = time.perf_counter()
+    # every experiment of the batch gets the whole budget
+    args = with_deadline(args)
+    try:
+        with path.with_suffix(".log").open("w") as log, redirect_stdout(log):
+            solve_experiment(root, args, verbose=False)
+    except MemoryError:
+        return root, "out of memory", time.perf_counter() - start
+    except Exception as e:
+        return root, f"failed: {e!r}", time.perf_counter() - start
+    return root, "solved", time.perf_counter() - start
+
+
+def run_batch(args):
+    roots = sorted(Path(p) for p in glob.glob(args.data_root) if Path(p).is_dir())
+    todo, status = [], {}
+    for root in roots:
+        path = solution_path(root, args.denom, args.merges, args.variant, args.langlist)
+        incomplete = find_incomplete(root, args.variant)
+        if incomplete is not None:
+            status[root] = f"incomplete: {incomplete}"
+        elif not args.force and is_up_to_date(root, path, args.variant, args.langlist):
+            status[root] = "up to date"
+        else:
+            todo.append(root)
+
+    print(f"{len(roots)} experiments, {len(todo)} to solve with {args.jobs} jobs")
+    start = time.perf_counter()
+    ctx = mp.get_context("fork")
+    # a fresh process per solve, so one solve's memory doesn't count against the next
+    with ctx.Pool(
+        args.jobs, initializer=limit_memory, initargs=(args.memory_budget,), maxtasksperchild=1
+    ) as pool:
+        results = pool.imap_unordered(partial(batch_solve, args=args), todo)
+        for root, result, elapsed in tqdm.tqdm(results, total=len(todo), dynamic_ncols=True):
+            status[root] = result
+            tqdm.tqdm.write(f"{root}: {result} ({elapsed:.1f}s)")
+    elapsed = time.perf_counter() - start
+
+    counts = Counter(result.split(":")[0] for result in status.values())
+    print(dict(counts))
+    solved = counts["solved"]
+    if solved:
+        print(f"{solved} solves in {elapsed:.1f}s ({3600 * solved / elapsed:.1f} solves/hour)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="TokenizerInference")
+    parser.add_argument("data_root", help="Experiment dir, or a glob of experiment dirs with --batch")
+    parser.add_argument(
+        "--merges", type=int, help="Number of merges to consider", default=30000
+    )
+    parser.add_argument(
+        "--denom", type=str, help="Which normalization to apply", default="pairs"
+    )
+    parser.add_argument(
+        "--variant", type=str, help="Which language subdir to run", default=None
+    )
+    parser.add_argument(
+        "--langlist", type=str, help="Which language list to run", default=None
+    )
+    parser.add_argument(
+        "--workers", type=int, help="Processes to use for constraint separation", default=1
+    )
+    parser.add_argument(
+        "--snapshot_interval",
+        type=int,
+        help="Merges per parallel separation chunk (default: 4 chunks per worker)",
+        default=None,
+    )
+    parser.add_argument(
+        "--backend", type=str, help="Which LP solver to use", default="gurobi", choices=BACKENDS
+    )
+    parser.add_argument(
+        "--merges_ladder",
+        "--merges-ladder",
+        type=lambda s: [int(t) for t in s.split(",")],
+        help="Comma separated merge counts to solve in one run, e.g. 100,300,1000 (overrides --merges)",
+        default=None,
+    )
+    parser.add_argument(
+        "--langlist_sweep",
+        type=lambda s: s.split(","),
+        help="Comma separated language lists to solve in one run, e.g. langlist_omit1,langlist_omit2",
+        default=None,
+    )
+    parser.add_argument(
+        "--denoms",
+        type=lambda s: s.split(","),
+        help="Comma separated normalizations to solve for in one run (overrides --denom)",
+        default=None,
+    )
+    parser.add_argument(
+        "--groups",
+        type=str,
+        help="JSON file of category groups ({group: [categories]}) to solve coarse to fine",
+        default=None,
+    )
+    parser.add_argument(
+        "--group_threshold",
+        type=float,
+        help="Coarse weight above which a group is split into its categories (with --groups)",
+        default=1e-3,
+    )
+    parser.add_argument(
+        "--columns",
+        type=int,
+        help="Start from this many categories and add the others by column generation",
+        default=None,
+    )
+    parser.add_argument(
+        "--columns_per_round",
+        type=int,
+        help="Categories to add per column generation round (with --columns)",
+        default=10,
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Parse all_pair_counts.json one merge step at a time, stopping after --merges",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Reuse the precomputation from precompute_[merges]_[key].npz if the inputs are unchanged",
+    )
+    parser.add_argument(
+        "--prune_pairs",
+        action="store_true",
+        help="Drop pairs whose count never exceeds the merge's in any category before solving",
+    )
+    parser.add_argument(
+        "--warm_start",
+        action="store_true",
+        help="Start from an approximate mixture found by projected subgradient descent",
+    )
+    parser.add_argument(
+        "--approx",
+        action="store_true",
+        help="Only estimate the mixture approximately (writes solution_approx_[options].json)",
+    )
+    parser.add_argument(
+        "--prune_after",
+        type=int,
+        help="Drop constraints that were non-binding for this many LP solves (default: never)",
+        default=None,
+    )
+    parser.add_argument(
+        "--schedule",
+        type=str,
+        help="How the per-epoch constraint limits evolve",
+        default="fixed",
+        choices=SCHEDULES,
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Scan for the next constraints while the LP solves, revalidating them afterwards",
+    )
+    parser.add_argument(
+        "--time_budget",
+        "--time-budget",
+        type=float,
+        help="Wall-clock seconds for all solves of the run, after which the current mixture is written (default: no limit)",
+        default=None,
+    )
+    parser.add_argument(
+        "--merge_stride",
+        type=int,
+        help="Only generate constraints for every k-th merge (writes solution_sampled_[options].json)",
+        default=None,
+    )
+    parser.add_argument(
+        "--merge_sample",
+        type=int,
+        help="Only generate constraints for a stratified random sample of this many merges",
+        default=None,
+    )
+    parser.add_argument(
+        "--compare_full",
+        action="store_true",
+        help="With --merge_stride or --merge_sample, also solve over all merges and compare",
+    )
+    parser.add_argument(
+        "--checkpoint_every",
+        type=int,
+        help="Epochs between solver checkpoints (0 disables checkpointing)",
+        default=10,
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="Continue from the last solver checkpoint"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Write per-epoch solver statistics to profile_[options].jsonl",
+    )
+    parser.add_argument(
+        "--service",
+        type=str,
+        help="URL of a running solver_service.py to send the solve to, e.g. http://localhost:8484",
+        default=None,
+    )
+    parser.add_argument(
+        "--batch", action="store_true", help="Solve every experiment dir matching data_root"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Experiments (with --batch) or denominators (with --denoms) to solve in parallel",
+        default=1,
+    )
+    parser.add_argument(
+        "--memory_budget", type=float, help="Memory limit per batch job in GB", default=None
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Re-solve experiments with up to date solutions"
+    )
+    args = parser.parse_args()
+    if (args.batch or (args.denoms and args.jobs > 1)) and args.workers > 1:
+        # pool workers are daemonic and can't start a separation pool of their own
+        parser.error("--workers can't be combined with parallel --jobs")
+    if args.merge_stride is not None and args.merge_sample is not None:
+        parser.error("--merge_stride and --merge_sample are mutually exclusive")
+    # every mode, and the options it would silently ignore
+    ignored = dict(
+        # no LP is solved, only approximate_mixture runs
+        approx=[
+            "merge_stride",
+            "merge_sample",
+            "compare_full",
+            "resume",
+            "checkpoint_every",
+            "profile",
+            "time_budget",
+            "backend",
+            "warm_start",
+            "prune_after",
+            "schedule",
+            "pipeline",
+        ],
+        batch=[],
+        columns=[
+            "merge_stride",
+            "merge_sample",
+            "compare_full",
+            "resume",
+            "checkpoint_every",
+            "profile",
+            # every round precomputes its own subset
+            "cache",
+            "prune_pairs",
+        ],
+        denoms=["compare_full"],
+        # the service loads, precomputes and solves with its own settings
+        service=[
+            "workers",
+            "snapshot_interval",
+            "stream",
+            "cache",
+            "prune_pairs",
+            "merge_stride",
+            "merge_sample",
+            "compare_full",
+            "resume",
+            "checkpoint_every",
+            "profile",
+        ],
+        groups=[
+            "merge_stride", "merge_sample", "compare_full", "resume", "checkpoint_every", "profile"
+        ],
+        langlist_sweep=["compare_full"],
+        merges_ladder=["compare_full"],
+    )
+    modes = [mode for mode in ignored if getattr(args, mode) not in (None, False)]
+    if len(modes) > 1:
+        parser.error(f"only one of {', '.join('--' + mode for mode in modes)} can be given")
+    for mode in modes:
+        given = [
+            option for option in ignored[mode] if getattr(args, option) != parser.get_default(option)
+        ]
+        if given:
+            parser.error(f"--{mode} can't be combined with {', '.join('--' + o for o in given)}")
+    if args.batch:
+        run_batch(args)
+        sys.exit()
+    args = with_deadline(args)
+
+    root = Path(args.data_root)
+    print(Path.cwd(), root)
+    assert Path.cwd().exists()
+    assert root.resolve().exists()
+    incomplete = find_incomplete(root, args.variant)
+    if incomplete is not None:
+        print(f"incomplete: {incomplete}")
+        sys.exit()
+
+    if args.service is not None:
+        solution = solve_remote(root, args, args.service)
+        print(solution["lang_vals"])
+    elif args.approx:
+        solution = approx_experiment(root, args)
+        print(solution["lang_vals"])
+    elif args.denoms is not None:
+        for denom, solution in solve_denoms(root, args).items():
+            print(denom, solution["lang_vals"])
+    elif args.columns is not None:
+        solution = solve_column_generation(root, args)
+        print(solution["lang_vals"])
+    elif args.groups is not None:
+        solution = solve_grouped(root, args)
+        print(solution["lang_vals"])
+    elif args.langlist_sweep is not None:
+        for langlist, solution in solve_langlists(root, args).items():
+            print(langlist, solution["lang_vals"])
+    elif args.merges_ladder is not None:
+        for num_merges, solution in solve_ladder(root, args).items():
+            print(num_merges, solution["lang_vals"])
+    else:
+        solution = solve_experiment(root, args)
+        print(solution["lang_vals"])
@@ -0,0 +1,75 @@
+"""
+Separation schedules for lazy_optimize.
+
+A schedule picks the competitor batch size (competitors added per merge) and the add limit
+(constraints added per epoch) before every epoch, and whether separation should stop at the
+first merges that reach the add limit or scan the whole merge range and keep the most violated
+constraints.
+
+FixedSchedule is the original behaviour. AdaptiveSchedule aims at total wall-clock time: every
+epoch costs one separation scan plus one LP solve, so while the scan dominates it pays to add
+more constraints per epoch (fewer epochs), and once the LP dominates it pays to add fewer.
+"""
+
+
+class FixedSchedule:
+    ranked = False
+
+    def __init__(self, competitor_batch_size=10, max_add=100):
+        self.competitor_batch_size = competitor_batch_size
+        self.max_add = max_add
+
+    def update(self, scan, separation_time, lp_time):
+        pass
+
+    def state(self):
+        return dict(competitor_batch_size=self.competitor_batch_size, max_add=self.max_add)
+
+
+class AdaptiveSchedule(FixedSchedule):
+    # scan the whole merge range every epoch and keep the most violated constraints
+    ranked = True
+
+    def __init__(
+        self,
+        competitor_batch_size=10,
+        max_add=100,
+        min_add=10,
+        max_add_limit=10000,
+        max_batch_size=100,
+    ):
+        super().__init__(competitor_batch_size, max_add)
+        self.min_add, self.max_add_limit = min_add, max_add_limit
+        self.max_batch_size = max_batch_size
+
+    def update(self, scan, separation_time, lp_time):
+        """
+        Adjust the limits from the epoch that just finished.
+        """
+        # balance the two halves of an epoch
+        if lp_time < separation_time / 2:
+            self.max_add = min(2 * self.max_add, self.max_add_limit)
+        elif lp_time > 2 * separation_time:
+            self.max_add = max(self.max_add // 2, self.min_add)
+
+        # if most violated merges filled their batch, there are more competitors to be had
+        violated = [entry for entry in scan.violations if entry]
+        if violated:
+            full = sum(len(entry) >= self.competitor_batch_size for entry in violated)
+            if full > len(violated) / 2:
+                self.competitor_batch_size = min(
+                    2 * self.competitor_batch_size, self.max_batch_size
+                )
+            elif full < len(violated) / 10:
+                self.competitor_batch_size = max(self.competitor_batch_size // 2, 1)
+
+
+SCHEDULES = ("fixed", "adaptive")
+
+
+def make_schedule(name, competitor_batch_size=10, max_add=100):
+    if name == "fixed":
+        return FixedSchedule(competitor_batch_size, max_add)
+    if name == "adaptive":
+        return AdaptiveSchedule(competitor_batch_size, max_add)
+    raise ValueError(f"Unknown schedule: {name} (expected one of {SCHEDULES})")
@@ -0,0 +1,6 @@
+# Convert every category's all_pair_counts.json into the binary, memory-mapped store read by load_data.
+test_id=0
+experiment_dir=experiments/mixed_languages/n_112/$test_id
+
+python -m pair_store \
+    --experiment_dir $experiment_dir
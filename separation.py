@@ -0,0 +1,374 @@
+"""
+Constraint separation for lazy_optimize.
+
+For a fixed mixture, the priority of pair p at merge step i is mix @ counts_i[p] minus the
+pair's violation slack. Merge i is violated by every other pair whose priority exceeds the
+merge's own (plus the merge's slack). A scan walks a range of merge steps, advancing the
+priorities with the per-step count deltas and pulling violating competitors off a tournament
+tree.
+
+Because priorities at step i only depend on the mixture and the counts at step i, the merge
+range can also be cut into chunks that start from count snapshots and are scanned by a process
+pool (ParallelScanner). Chunk results are merged in merge order and cut off at max_add exactly
+where a sequential scan would have stopped, so the constraints found do not depend on timing.
+Once the cutoff is reached, the chunks still queued or running are cancelled, so the next scan
+doesn't wait behind them. Both scanners also take a cancelled callback (e.g. a deadline) and
+return what they scanned so far once it returns True.
+"""
+
+import bisect
+import math
+import multiprocessing as mp
+from collections import deque
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from tournament_tree import TournamentTree
+
+# merge steps whose deltas are mixed with one sparse mat-vec, starting small since scans often
+# stop after a few merges
+MIX_BLOCK = 256
+
+
+@dataclass
+class ScanResult:
+    # (merge index, merge pair, violating competitors, {pair: priority at that merge})
+    found: list = field(default_factory=list)
+    # merge index -> [(pair, priority), ...] as visited by the scan
+    active: dict = field(default_factory=dict)
+    exit_merge: int = -1
+    num_found: int = 0
+    # entries pulled off the tree, and how many of them beat the cutoff
+    pops: int = 0
+    candidates: int = 0
+    # for every found entry, how far each competitor's priority exceeds the cutoff
+    violations: list = field(default_factory=list)
+
+    def most_violated(self, max_add):
+        """
+        Keep only the max_add most violated competitors, wherever they are in the merge range.
+        """
+        ranked = sorted(
+            (-v, k, j)
+            for k, entry_violations in enumerate(self.violations)
+            for j, v in enumerate(entry_violations)
+        )
+        keep = {}
+        for _, k, j in ranked[:max_add]:
+            keep.setdefault(k, []).append(j)
+        result = ScanResult(
+            active=self.active,
+            exit_merge=self.exit_merge,
+            pops=self.pops,
+            candidates=self.candidates,
+        )
+        for k in sorted(keep):
+            i, mid, competitors, cand_prios = self.found[k]
+            kept = sorted(keep[k])
+            result.found.append((i, mid, [competitors[j] for j in kept], cand_prios))
+            result.violations.append([self.violations[k][j] for j in kept])
+            result.num_found += len(kept)
+        return result
+
+
+def revalidate(scan, count_index, mix, pviol, viol_vals, all_constraints, primal_tol):
+    """
+    The constraints of a scan done at an earlier mixture that are still violated (and not yet
+    added) at mix, with their priorities recomputed.
+    """
+    result = ScanResult(exit_merge=scan.exit_merge, pops=scan.pops, candidates=scan.candidates)
+    for i, mid, competitors, _ in scan.found:
+        pairs = [mid] + competitors
+        prios = count_index.counts_at(i, pairs) @ mix - pviol[pairs]
+        cutoff = prios[0] + pviol[mid] + max(0, viol_vals[i]) + primal_tol
+        kept = [
+            (pair, prio - cutoff)
+            for pair, prio in zip(competitors, prios[1:].tolist())
+            if prio > cutoff and (i, pair) not in all_constraints
+        ]
+        if kept:
+            cand_prios = dict(zip(pairs, prios.tolist()))
+            result.found.append((i, mid, [pair for pair, _ in kept], cand_prios))
+            result.violations.append([violation for _, violation in kept])
+            result.num_found += len(kept)
+    return result
+
+
+def scan_merges(
+    delta_count_arrays,
+    prios,
+    mids,
+    viol_vals,
+    pviol,
+    all_constraints,
+    mix,
+    start,
+    stop,
+    competitor_batch_size,
+    max_add,
+    primal_tol,
+    debug=False,
+    progress=lambda x, **_: x,
+    cancelled=None,
+):
+    """
+    Scan merges start..stop-1, where prios holds the priorities at step start. prios is
+    advanced in place. If cancelled is given, the scan stops early once it returns True, and
+    the result only covers the merges up to its exit_merge.
+    """
+    pq = TournamentTree.from_numpy(prios)
+    result = ScanResult(exit_merge=start - 1)
+    indptr, block, block_stop = delta_count_arrays.indptr, 8, start
+    for i in progress(range(start, stop)):
+        if cancelled is not None and cancelled():
+            break
+        mid = mids[i]
+        if mid is not None:
+            # we want the prio without the pair violation
+            mprio = prios[mid] + pviol[mid]
+            cutoff = mprio + max(0, viol_vals[i]) + primal_tol
+            active = result.active[i] = []
+            competitors, violations = [], []
+
+            # the tree is only read here, so nothing has to be pushed back afterwards
+            for tid, tprio in pq.descending(exclude=mid):
+                active.append((tid, tprio))
+                result.pops += 1
+                if tprio <= cutoff:
+                    break
+                result.candidates += 1
+                if (i, tid) not in all_constraints:
+                    competitors.append(tid)
+                    violations.append(tprio - cutoff)
+                    if len(competitors) >= competitor_batch_size:
+                        break
+
+            if competitors:
+                cand_prios = {pair: prios[pair] for pair in [mid] + competitors}
+                result.found.append((i, mid, competitors, cand_prios))
+                result.violations.append(violations)
+                result.num_found += len(competitors)
+
+        if i + 1 < stop:
+            if i >= block_stop:
+                block = min(2 * block, MIX_BLOCK)
+                block_stop = min(i + block, stop - 1)
+                mixed = delta_count_arrays.mixed(mix, i, block_stop)
+                base = indptr[i]
+            lo, hi = indptr[i], indptr[i + 1]
+            items = delta_count_arrays.pair_ids[lo:hi]
+            mixdcounts = mixed[lo - base : hi - base]
+
+            if debug:
+                for idx, mdc in zip(items, mixdcounts):
+                    assert (
+                        mdc <= 1e-7 or prios[idx] <= 1e-7
+                    ), f"{idx=}, {mdc=}, {prios[idx]=}"
+
+            prios[items] += mixdcounts
+            pq.update(items, prios[items])
+
+        result.exit_merge = i
+        if result.num_found >= max_add:
+            break
+
+    return result
+
+
+class Scanner:
+    """
+    Scans the whole merge range in the calling process.
+    """
+
+    def __init__(self, pre, mids, debug=False, progress=lambda x, **_: x):
+        self.pre = pre
+        self.mids = mids
+        self.debug = debug
+        self.progress = progress
+
+    def scan(
+        self,
+        mix,
+        pviol,
+        viol_vals,
+        all_constraints,
+        competitor_batch_size,
+        max_add,
+        primal_tol,
+        cancelled=None,
+    ):
+        prios = self.pre.initial_prios(mix)
+        prios -= pviol
+        return scan_merges(
+            self.pre.delta_count_arrays,
+            prios,
+            self.mids,
+            viol_vals,
+            pviol,
+            all_constraints,
+            mix,
+            0,
+            len(self.mids),
+            competitor_batch_size,
+            max_add,
+            primal_tol,
+            debug=self.debug,
+            progress=self.progress,
+            cancelled=cancelled,
+        )
+
+    def close(self):
+        pass
+
+
+# state shared with the pool workers, which inherit it when they are forked
+_shared = None
+
+
+def _scan_chunk(task):
+    scan_id, chunk, mix, pviol, viol_vals, constraints, competitor_batch_size, max_add, primal_tol = task
+    scanner = _shared
+    cancelled = lambda: scanner.finished.value >= scan_id
+    if cancelled():
+        # queued behind a scan that already has enough constraints
+        return None
+    start, stop = scanner.bounds[chunk], scanner.bounds[chunk + 1]
+    prios = scanner.snapshots[chunk] @ mix - pviol
+    return scan_merges(
+        scanner.pre.delta_count_arrays,
+        prios,
+        scanner.mids,
+        viol_vals,
+        pviol,
+        constraints,
+        mix,
+        start,
+        stop,
+        competitor_batch_size,
+        max_add,
+        primal_tol,
+        debug=scanner.debug,
+        cancelled=cancelled,
+    )
+
+
+class ParallelScanner(Scanner):
+    """
+    Splits the merge range into chunks of snapshot_interval merges, each starting from a
+    snapshot of the cumulative counts, and scans them on a pool of forked workers. The
+    precomputed arrays are shared with the workers copy-on-write instead of being pickled.
+    """
+
+    def __init__(self, pre, mids, workers, snapshot_interval=None, debug=False, progress=lambda x, **_: x):
+        super().__init__(pre, mids, debug=debug, progress=progress)
+        num_merges = len(mids)
+        if snapshot_interval is None:
+            # a few chunks per worker, so an early max_add cutoff wastes little work
+            snapshot_interval = math.ceil(num_merges / (4 * workers))
+        self.bounds = list(range(0, num_merges, max(snapshot_interval, 1))) + [num_merges]
+        num_pairs = len(pre.id_to_pair)
+        self.snapshots = [
+            pre.count_index.snapshot(start, num_pairs)
+            for start in progress(self.bounds[:-1], desc="count snapshots")
+        ]
+        self.workers = workers
+        ctx = mp.get_context("fork")
+        # the number of the last scan that is done, shared with the workers so they can drop
+        # the chunks of a scan that was cut off at max_add
+        self.finished = ctx.RawValue("q", 0)
+        self.scan_id = 0
+
+        global _shared
+        _shared = self
+        self.pool = ctx.Pool(workers)
+
+    def scan(
+        self,
+        mix,
+        pviol,
+        viol_vals,
+        all_constraints,
+        competitor_batch_size,
+        max_add,
+        primal_tol,
+        cancelled=None,
+    ):
+        viol_vals = np.asarray(viol_vals)
+        num_chunks = len(self.bounds) - 1
+        self.scan_id += 1
+        by_chunk = [set() for _ in range(num_chunks)]
+        for i, tid in all_constraints:
+            by_chunk[bisect.bisect_right(self.bounds, i) - 1].add((i, tid))
+
+        def submit(chunk):
+            task = (
+                self.scan_id,
+                chunk,
+                mix,
+                pviol,
+                viol_vals,
+                by_chunk[chunk],
+                competitor_batch_size,
+                max_add,
+                primal_tol,
+            )
+            return self.pool.apply_async(_scan_chunk, (task,))
+
+        # keep every worker busy, but consume the chunks strictly in merge order
+        pending, next_chunk = deque(), 0
+        while next_chunk < num_chunks and len(pending) < self.workers:
+            pending.append(submit(next_chunk))
+            next_chunk += 1
+
+        result = ScanResult()
+        try:
+            for _ in self.progress(range(num_chunks), desc="scanning chunks"):
+                if not pending:
+                    break
+                task = pending.popleft()
+                while cancelled is not None and not task.ready():
+                    task.wait(0.1)
+                    if cancelled():
+                        # given up by the caller, the chunks scanned so far are returned
+                        pending.appendleft(task)
+                        return result
+                part = task.get()
+                if next_chunk < num_chunks:
+                    pending.append(submit(next_chunk))
+                    next_chunk += 1
+
+                result.active.update(part.active)
+                result.exit_merge = part.exit_merge
+                result.pops += part.pops
+                result.candidates += part.candidates
+                for entry, violations in zip(part.found, part.violations):
+                    result.found.append(entry)
+                    result.violations.append(violations)
+                    result.num_found += len(entry[2])
+                    if result.num_found >= max_add:
+                        # cut off exactly where the sequential scan would have stopped
+                        result.exit_merge = entry[0]
+                        result.active = {
+                            i: active for i, active in result.active.items() if i <= entry[0]
+                        }
+                        return result
+            return result
+        finally:
+            # cancel the chunks that are still queued or running, and wait for them so that
+            # none of them is left in the pool when the next scan starts
+            self.finished.value = self.scan_id
+            for task in pending:
+                task.wait()
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+def make_scanner(pre, mids, workers=1, snapshot_interval=None, debug=False, progress=lambda x, **_: x):
+    if workers > 1:
+        return ParallelScanner(
+            pre, mids, workers, snapshot_interval=snapshot_interval, debug=debug, progress=progress
+        )
+    return Scanner(pre, mids, debug=debug, progress=progress)
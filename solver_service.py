@@ -0,0 +1,248 @@
+"""
+Long-lived solver service that keeps experiments loaded and precomputed between solves.
+
+    python solver_service.py --port 8484 --workers 2 --memory_cap 16
+
+POST /solve with a JSON object of solve parameters (data_root is required, the other keys
+default to the run_solver.py defaults) returns the solution JSON. GET /status lists the cached
+experiments. run_solver.py --service http://localhost:8484 sends its arguments here instead of
+solving locally.
+
+Every experiment is loaded once with all of its categories and precomputed for the largest
+number of merges requested so far, which also serves every smaller request and every language
+list (by selecting rows of the precomputation). Solves run in processes forked from the
+service, so they share the cached arrays copy-on-write, and at most --workers run at a time;
+further requests wait in line. When the cached precomputations exceed --memory_cap, the least
+recently used experiments are evicted.
+"""
+
+import multiprocessing as mp
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import click
+import simdjson as json
+
+from precompute import precompute
+from run_solver import format_solution, lazy_optimize, solution_path
+from utils import load_data, load_langlist
+
+DEFAULTS = dict(
+    merges=30000,
+    denom="pairs",
+    variant=None,
+    langlist=None,
+    competitor_batch_size=10,
+    max_add=100,
+    backend="gurobi",
+    schedule="fixed",
+    prune_after=None,
+    warm_start=False,
+    pipeline=False,
+    time_budget=None,
+    write=False,
+)
+SOLVER_PARAMS = (
+    "competitor_batch_size",
+    "max_add",
+    "backend",
+    "schedule",
+    "prune_after",
+    "warm_start",
+    "pipeline",
+    "time_budget",
+)
+
+
+class Experiment:
+    def __init__(self, root, variant):
+        self.root, self.variant = root, variant
+        self.lock = threading.Lock()
+        self.merges = self.pair_counts = self.training_counts = self.pre = None
+        self.num_merges = 0
+
+    def prepare(self, num_merges):
+        """
+        Load the experiment and precompute for at least num_merges merges, if not done yet.
+        """
+        with self.lock:
+            if self.merges is None:
+                # streamed, so nothing but the precomputed arrays stays in memory
+                self.merges, self.pair_counts, self.training_counts = load_data(
+                    self.root, subdir=self.variant, stream=True
+                )
+            if num_merges > self.num_merges:
+                self.pre = precompute(self.pair_counts, num_merges, verbose=False)
+                self.num_merges = num_merges
+
+    @property
+    def nbytes(self):
+        if self.pre is None:
+            return 0
+        arrays = sum(size for size, _ in self.pre.memory_report().values())
+        # rough size of the pair strings and the pair_to_id dict
+        return arrays + 200 * len(self.pre.id_to_pair)
+
+
+class ExperimentCache:
+    def __init__(self, memory_cap):
+        self.memory_cap = memory_cap
+        self.experiments = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, root, variant, num_merges):
+        key = (str(root), variant)
+        with self.lock:
+            experiment = self.experiments.pop(key, None) or Experiment(root, variant)
+            self.experiments[key] = experiment
+        experiment.prepare(num_merges)
+        with self.lock:
+            # evict least recently used first, but never the experiment being served
+            while self.total() > self.memory_cap and next(iter(self.experiments)) != key:
+                evicted, _ = self.experiments.popitem(last=False)
+                print(f"evicted {evicted}")
+        return experiment
+
+    def total(self):
+        return sum(experiment.nbytes for experiment in self.experiments.values())
+
+    def status(self):
+        with self.lock:
+            return dict(
+                memory_cap=self.memory_cap,
+                memory=self.total(),
+                experiments=[
+                    dict(root=root, variant=variant, merges=e.num_merges, bytes=e.nbytes)
+                    for (root, variant), e in self.experiments.items()
+                ],
+            )
+
+
+def solve(experiment, params):
+    """
+    Solve one request against a prepared experiment. Runs in a forked child.
+    """
+    root, pre, pair_counts = experiment.root, experiment.pre, experiment.pair_counts
+    if params["langlist"] is not None:
+        all_langs = list(pair_counts.keys())
+        langs = [item.name for item in load_langlist(root, params["langlist"])]
+        langs = [lang for lang in langs if lang in pair_counts]
+        pre = pre.select_langs([all_langs.index(lang) for lang in langs])
+        pair_counts = {lang: pair_counts[lang] for lang in langs}
+
+    kwargs = dict(verbose=False, num_merges=params["merges"])
+    kwargs.update((key, params[key]) for key in SOLVER_PARAMS)
+    solution = lazy_optimize(
+        experiment.merges,
+        pair_counts,
+        experiment.training_counts[params["denom"]],
+        pre=pre,
+        **kwargs,
+    )
+    solution = format_solution(solution, kwargs, params["denom"])
+    if params["write"]:
+        path = solution_path(
+            root, params["denom"], params["merges"], params["variant"], params["langlist"]
+        )
+        with path.open("w") as f:
+            json.dump(solution, f)
+    return solution
+
+
+def _solve_child(conn, experiment, params):
+    try:
+        conn.send(("ok", json.dumps(solve(experiment, params))))
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+    conn.close()
+
+
+def solve_in_child(experiment, params):
+    ctx = mp.get_context("fork")
+    parent, child = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_solve_child, args=(child, experiment, params))
+    process.start()
+    child.close()
+    try:
+        status, payload = parent.recv()
+    except EOFError:
+        process.join()
+        return "error", f"solver process died with exit code {process.exitcode}"
+    process.join()
+    return status, payload
+
+
+class SolverService(ThreadingHTTPServer):
+    def __init__(self, address, workers, memory_cap):
+        super().__init__(address, SolverHandler)
+        self.cache = ExperimentCache(memory_cap)
+        self.pool = ThreadPoolExecutor(workers)
+
+
+class SolverHandler(BaseHTTPRequestHandler):
+    def reply(self, code, body):
+        body = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/status":
+            return self.reply(404, dict(error=f"unknown path {self.path}"))
+        self.reply(200, self.server.cache.status())
+
+    def do_POST(self):
+        if self.path != "/solve":
+            return self.reply(404, dict(error=f"unknown path {self.path}"))
+        try:
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            unknown = set(request) - set(DEFAULTS) - {"data_root"}
+            if unknown:
+                raise ValueError(f"unknown parameters {sorted(unknown)}")
+            params = dict(DEFAULTS, **request)
+            root = Path(params.pop("data_root"))
+            if not (root / "merges.txt").exists():
+                raise ValueError(f"{root} is not an experiment dir")
+        except (KeyError, TypeError, ValueError) as e:
+            return self.reply(400, dict(error=str(e)))
+
+        def run():
+            experiment = self.server.cache.get(root, params["variant"], params["merges"])
+            return solve_in_child(experiment, params)
+
+        status, payload = self.server.pool.submit(run).result()
+        if status == "ok":
+            self.reply(200, payload)
+        else:
+            self.reply(500, dict(error=payload))
+
+
+@click.command()
+@click.option('--host', type=str, default='127.0.0.1')
+@click.option('--port', type=int, default=8484)
+@click.option(
+    '--workers',
+    type=int,
+    default=1,
+    help='Solves to run at the same time, further requests are queued.'
+)
+@click.option(
+    '--memory_cap',
+    type=float,
+    default=8,
+    help='GB of precomputed experiments to keep before evicting the least recently used.'
+)
+def main(host: str, port: int, workers: int, memory_cap: float):
+    server = SolverService((host, port), workers, memory_cap * 2**30)
+    print(f"serving on http://{host}:{port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import random
+from collections import Counter
+
+import pytest
+import simdjson as json
+
+
+def word_pairs(words):
+    counts = Counter()
+    for word, freq in words.items():
+        for a, b in zip(word, word[1:]):
+            counts[a, b] += freq
+    return counts
+
+
+def apply_merge(words, merge):
+    merged = Counter()
+    for word, freq in words.items():
+        out, i = [], 0
+        while i < len(word):
+            if i + 1 < len(word) and (word[i], word[i + 1]) == merge:
+                out.append(word[i] + word[i + 1])
+                i += 2
+            else:
+                out.append(word[i])
+                i += 1
+        merged[tuple(out)] += freq
+    return merged
+
+
+def make_experiment(root, num_langs=4, num_merges=150, seed=0):
+    """
+    Train BPE on a random mixture of small synthetic categories and write the experiment dir
+    (merges.txt, meta.json and every category's all_pair_counts.json) to root.
+    """
+    rng = random.Random(seed)
+    langs = [f"l{k}" for k in range(num_langs)]
+    corpora = {}
+    for lang in langs:
+        alphabet = rng.sample("abcdefghijklmnopqrstuvwxyz", 12)
+        weights = [rng.random() ** 3 for _ in alphabet]
+        words = Counter()
+        for _ in range(1000):
+            word = rng.choices(alphabet, weights, k=rng.randint(2, 7))
+            words[tuple(word)] += rng.randint(1, 20)
+        corpora[lang] = words
+
+    mixture = Counter()
+    for lang in langs:
+        weight = rng.random()
+        for word, freq in corpora[lang].items():
+            mixture[word] += freq * weight * 1000
+    merges = []
+    for _ in range(num_merges):
+        counts = word_pairs(mixture)
+        merge = max(counts.items(), key=lambda item: (item[1], item[0]))[0]
+        merges.append(merge)
+        mixture = apply_merge(mixture, merge)
+
+    root.mkdir(parents=True, exist_ok=True)
+    (root / "merges.txt").write_text(
+        "#version: 0.2\n" + "".join(f"{a} {b}\n" for a, b in merges)
+    )
+    byte_count = {
+        lang: sum(len(word) * freq for word, freq in corpora[lang].items()) for lang in langs
+    }
+    with (root / "meta.json").open("w") as f:
+        json.dump(dict(byte_count=byte_count), f)
+    for lang in langs:
+        words, previous, steps = corpora[lang], {}, []
+        for merge in merges:
+            counts = {f"{a} {b}": count for (a, b), count in word_pairs(words).items()}
+            # the first step holds all counts, later ones only the changes
+            step = {pair: count for pair, count in counts.items() if previous.get(pair) != count}
+            step.update((pair, 0) for pair in previous if pair not in counts)
+            steps.append(step)
+            previous = counts
+            words = apply_merge(words, merge)
+        (root / lang).mkdir(exist_ok=True)
+        with (root / lang / "all_pair_counts.json").open("w") as f:
+            json.dump(steps, f)
+        with (root / lang / "meta.json").open("w") as f:
+            json.dump(dict(byte_count=byte_count[lang]), f)
+    return root
+
+
+@pytest.fixture(scope="session")
+def experiment(tmp_path_factory):
+    return make_experiment(tmp_path_factory.mktemp("experiment"))
@@ -0,0 +1,14 @@
+import numpy as np
+
+from approx import approximate_mixture
+from precompute import precompute
+from utils import load_data
+
+
+def test_approximate_mixture_without_constrainable_merges(experiment):
+    _, pair_counts, training_counts = load_data(experiment)
+    pre = precompute(pair_counts, 150, verbose=False)
+    denoms = np.array([training_counts["pairs"][lang] for lang in pair_counts])
+    lang_vals, blocks, stats = approximate_mixture(pre, [None] * 150, denoms)
+    assert np.allclose(lang_vals, 1 / len(denoms))
+    assert blocks == [] and stats["sampled_merges"] == 0
@@ -0,0 +1,67 @@
+import argparse
+
+import numpy as np
+import pytest
+
+from precompute import precompute
+from run_solver import lazy_optimize, solve_langlists
+from utils import load_data, load_langlist
+
+
+@pytest.fixture(scope="module")
+def langlists(experiment):
+    langs = sorted(path.name for path in experiment.iterdir() if path.is_dir())
+    names = []
+    for lang in langs:
+        name = f"omit_{lang}"
+        (experiment / f"{name}.txt").write_text("\n".join(l for l in langs if l != lang) + "\n")
+        names.append(name)
+    return names
+
+
+def test_sweep_matches_standalone_solves(experiment, langlists):
+    args = argparse.Namespace(
+        merges=150,
+        denom="pairs",
+        variant=None,
+        langlist=None,
+        langlist_sweep=langlists,
+        backend="highs",
+        workers=1,
+        snapshot_interval=None,
+        checkpoint_every=0,
+        warm_start=False,
+        prune_after=None,
+        schedule="fixed",
+        pipeline=False,
+        time_budget=None,
+        deadline=None,
+        stream=False,
+        cache=False,
+        prune_pairs=False,
+        merge_stride=None,
+        merge_sample=None,
+        resume=False,
+        profile=False,
+    )
+    swept = solve_langlists(experiment, args, verbose=False)
+    for name in langlists:
+        merges, pair_counts, training_counts = load_data(experiment, langlist=name)
+        assert list(pair_counts) == [item.name for item in load_langlist(experiment, name)]
+        alone = lazy_optimize(
+            merges,
+            pair_counts,
+            training_counts["pairs"],
+            verbose=False,
+            num_merges=150,
+            backend="highs",
+        )
+        assert sorted(swept[name]["missing_merges"]) == sorted(alone["missing_merges"])
+        assert np.isclose(swept[name]["diagnostics"]["objective"], alone["diagnostics"]["objective"])
+        for lang, weight in alone["lang_vals"].items():
+            assert np.isclose(swept[name]["lang_vals"][lang], weight, atol=1e-6)
+
+
+def test_skipped_pair_is_pair_zero(experiment):
+    _, pair_counts, _ = load_data(experiment)
+    assert precompute(pair_counts, 150, verbose=False).skipped_pair() == 0
@@ -0,0 +1,26 @@
+import numpy as np
+
+from run_solver import lazy_optimize
+from utils import load_data
+
+
+def test_warm_start_matches_cold_start(experiment):
+    merges, pair_counts, training_counts = load_data(experiment)
+    solutions = {
+        warm_start: lazy_optimize(
+            merges,
+            pair_counts,
+            training_counts["pairs"],
+            verbose=False,
+            num_merges=150,
+            backend="highs",
+            warm_start=warm_start,
+        )
+        for warm_start in (False, True)
+    }
+    cold, warm = solutions[False]["diagnostics"], solutions[True]["diagnostics"]
+    assert warm["status"] == cold["status"] == "converged"
+    # the seeded rows have to be solved before convergence can be declared
+    assert solutions[True]["lp_size"]
+    assert warm["objective"] is not None
+    assert np.isclose(warm["objective"], cold["objective"])
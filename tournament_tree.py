@@ -0,0 +1,127 @@
+"""
+Array-backed indexed max tournament tree (a segment tree over max) keyed by pair id.
+
+Leaf i holds the current priority of pair i and every internal node holds the largest priority
+below it, together with the child that holds it. Priorities are updated in place, so unlike a
+heap with lazy deletion there are never stale entries. The tree is wide (fanout children per
+node) and therefore shallow, and batched updates are done one level at a time with NumPy, so
+their cost is a handful of vectorized operations per level rather than a Python loop per entry.
+
+descending() walks the tree best first and can be stopped after any item. The largest priority
+is found by following the stored best children down from the root, without looking at any
+siblings, so a caller that stops after the first item (the common case once the mixture is
+nearly feasible) pays for depth array lookups. Siblings are only looked at when the caller
+asks for the next item.
+"""
+
+import heapq
+from itertools import islice
+
+import numpy as np
+
+
+class TournamentTree:
+    def __init__(self, prios, fanout=64):
+        n = len(prios)
+        self.n = n
+        self.fanout = fanout
+        self.depth = 1
+        while fanout**self.depth < n:
+            self.depth += 1
+
+        # levels[0] are the leaves, levels[depth] is the root, and best[l][node] is the child
+        # (a node of levels[l]) holding the maximum of node in levels[l + 1]
+        leaves = np.full(fanout**self.depth, -np.inf)
+        leaves[:n] = prios
+        self.levels, self.best = [leaves], []
+        for _ in range(self.depth):
+            blocks = self.levels[-1].reshape(-1, fanout)
+            # argmax picks the first maximum, so ties go to the smallest pair id
+            best = blocks.argmax(1)
+            self.levels.append(blocks[np.arange(len(blocks)), best])
+            self.best.append(best + np.arange(0, blocks.size, fanout))
+
+    @classmethod
+    def from_numpy(cls, prios, fanout=64):
+        return cls(np.asarray(prios, np.float64), fanout)
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, pair):
+        return self.levels[0][pair]
+
+    def update(self, idx, prios):
+        """
+        Set the priorities of the pairs in idx.
+        """
+        idx = np.asarray(idx, np.int64)
+        if not len(idx):
+            return
+        self.levels[0][idx] = prios
+        nodes = idx
+        for below, level, best in zip(self.levels[:-1], self.levels[1:], self.best):
+            # duplicate nodes just get the same maximum twice, cheaper than deduplicating
+            nodes = nodes // self.fanout
+            blocks = below.reshape(-1, self.fanout)[nodes]
+            arg = blocks.argmax(1)
+            maxima = blocks[np.arange(len(nodes)), arg]
+            best[nodes] = nodes * self.fanout + arg
+            changed = level[nodes] != maxima
+            level[nodes] = maxima
+            # nodes whose maximum stayed the same don't change anything above them
+            nodes = nodes[changed]
+            if not len(nodes):
+                break
+
+    def max(self):
+        return self.top(1)[0]
+
+    def top(self, k, exclude=None):
+        """
+        The k highest priority pairs other than exclude, as (pair, priority) tuples in order
+        of decreasing priority (ties broken by pair id).
+        """
+        return list(islice(self.descending(exclude), k))
+
+    def descending(self, exclude=None):
+        """
+        Yield (pair, priority) in order of decreasing priority (ties broken by pair id),
+        skipping the pair exclude. The tree must not be updated while iterating.
+
+        The frontier is a heap of the subtrees not visited yet, keyed by their maximum and
+        their first leaf. The best one is followed down to its best leaf, and once that leaf
+        is done every node on the way gives way to its best unvisited sibling.
+        """
+        fanout, levels, best, depth, n = self.fanout, self.levels, self.best, self.depth, self.n
+        spans = [fanout**level for level in range(depth + 1)]
+        push, pop, inf = heapq.heappush, heapq.heappop, float("inf")
+        # (-priority, first leaf below, level, node)
+        frontier = [(-float(levels[depth][0]), 0, depth, 0)]
+        # children priorities of the visited nodes, with the visited children at -inf
+        unvisited = {}
+        while frontier:
+            neg, _, top, node = pop(frontier)
+            if neg == inf:
+                # only the padding (and pairs at -inf) is left
+                return
+            path = [node]
+            for level in range(top - 1, -1, -1):
+                node = int(best[level][node])
+                path.append(node)
+            if node < n and node != exclude:
+                yield node, -neg
+
+            # path[top - level] is the node at level
+            for level in range(min(top, depth - 1), -1, -1):
+                node = path[top - level]
+                parent = node // fanout
+                values = unvisited.get((level, parent))
+                lo = parent * fanout
+                if values is None:
+                    values = unvisited[level, parent] = levels[level][lo : lo + fanout].tolist()
+                values[node - lo] = -inf
+                sibling = max(values)
+                if sibling != -inf:
+                    k = lo + values.index(sibling)
+                    push(frontier, (-sibling, k * spans[level], level, k))
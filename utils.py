@@ -18,6 +18,7 @@ from tokenizers.pre_tokenizers import Digits, ByteLevel
 from tokenizers.trainers import BpeTrainer
 from constants import LLM_LANGS
 from llm_tokenizer_configs import LLM_NORMALIZERS, LLM_PRETOKENIZERS
+from pair_store import PairCountFile, PairCountStore, is_stale, store_path
 
 
 
@@ -318,7 +319,7 @@ def load_langlist(root, name):
         return [root / lang.strip() for lang in f.read().strip().split()]
 
 
-def load_data(data_root, verbose=False, subdir=None, langlist=None):
+def load_data(data_root, verbose=False, subdir=None, langlist=None, stream=False):
     merges, producer = postprocess_merges(load_merges(data_root / "merges.txt"))
 
     pair_counts = {}
@@ -343,8 +344,19 @@ def load_data(data_root, verbose=False, subdir=None, langlist=None):
         if subdir is not None:
             item = item / subdir
 
-        with (item / "all_pair_counts.json").open() as f:
-            pair_counts[lang] = json.load(f)
+        # prefer the binary store written by pair_store.py, it is memory-mapped instead of parsed
+        # with stream, all_pair_counts.json is parsed step by step during precomputation
+        has_store = (store_path(item) / "meta.json").exists()
+        if has_store and is_stale(item):
+            print(f"{store_path(item)} is older than all_pair_counts.json, reading the json instead")
+            has_store = False
+        if has_store:
+            pair_counts[lang] = PairCountStore(store_path(item))
+        elif stream:
+            pair_counts[lang] = PairCountFile(item / "all_pair_counts.json")
+        else:
+            with (item / "all_pair_counts.json").open() as f:
+                pair_counts[lang] = json.load(f)
 
         with (item / "meta.json").open() as f:
             data = json.load(f)
@@ -354,7 +366,10 @@ def load_data(data_root, verbose=False, subdir=None, langlist=None):
                     counter[lang] = data[key]
 
             counter = training_counts.setdefault("pairs", {})
-            counter[lang] = sum(pair_counts[lang][0].values())
+            if isinstance(pair_counts[lang], (PairCountStore, PairCountFile)):
+                counter[lang] = pair_counts[lang].total(0)
+            else:
+                counter[lang] = sum(pair_counts[lang][0].values())
 
     print(training_counts.keys())
     return merges, pair_counts, training_counts